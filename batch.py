@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Batch of five-or-more games, played in lockstep with numpy arrays
+"""
+
+import math
+from random import Random
+
+import numpy as np
+
+from board import Board
+from game import Game, BoardSize, Mode
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+#the four axes of a line (row step, col step)
+AXES = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+class BatchGame:
+    """N games in normal mode, with the same rules (and, for the same
+    seeds, the same trajectories) as Game.
+
+    The boards are stored in a single (N, n_rows, n_cols) array, using the
+    Board buffer encoding (Board.EMPTY for free cells, piece + 1 otherwise).
+    Each game keeps its own random generator, so that drops are the same
+    as in Game (with legacy sampling).
+    """
+
+    def __init__(self, seeds, size = BoardSize.SMALL, mode = Mode.NORMAL):
+        """Create len(seeds) games.
+
+        >>> b = BatchGame([1, 2, 3])
+        >>> b.boards.shape
+        (3, 7, 7)
+        >>> g = Game(seed = 2)
+        >>> b.get_board(1) == list(g.board.pieces)
+        True
+        >>> b.next_pieces[1].tolist() == g.next_pieces_queue
+        True
+        """
+        if mode != Mode.NORMAL:
+            #moves of distance mode depend on the exact path found by
+            #Board.find_path, use Game for this mode
+            raise ValueError("only normal mode is supported")
+        self.mode = mode
+        self.n_games = len(seeds)
+        (self.n_rows, self.n_cols, self.n_types, self.n_next_pieces) = Game.DIFFICULTY[size]
+        self.seeds = list(seeds)
+        self.rngs = [Random(s) for s in self.seeds]
+        self.boards = np.zeros((self.n_games, self.n_rows, self.n_cols), dtype=np.uint8)
+        self.scores = np.zeros(self.n_games, dtype=np.int64)
+        self.next_pieces = np.zeros((self.n_games, self.n_next_pieces), dtype=np.int64)
+        self.drop_delay = np.zeros(self.n_games, dtype=np.int64)
+        #score gained for n matched pieces, as in Game.update_score
+        max_line = 4 * (max(self.n_rows, self.n_cols) - 1) + 1
+        self.score_table = np.zeros(max_line + 1, dtype=np.int64)
+        for n in range(1, max_line + 1):
+            self.score_table[n] = int(45 * math.log(0.25 * n))
+        everyone = np.arange(self.n_games)
+        self._generate_next_pieces(everyone)
+        for i in range(3):
+            pieces = np.array([rng.randrange(self.n_types) for rng in self.rngs])
+            (rows, cols) = self._random_free_cells(everyone)
+            self.boards[everyone, rows, cols] = pieces + 1
+
+
+    def get_board(self, i):
+        """Return the board of game i, as a list in Board buffer order"""
+        return self.boards[i].ravel().tolist()
+
+
+    def n_free(self):
+        """Return the number of free cells of each game"""
+        return (self.boards == Board.EMPTY).sum(axis=(1, 2))
+
+
+    def game_over(self):
+        """Return a boolean array, True for finished games"""
+        return self.n_free() == 0
+
+
+    def _generate_next_pieces(self, idx):
+        for i in idx:
+            rng = self.rngs[i]
+            self.next_pieces[i] = [rng.randrange(self.n_types)
+                                   for p in range(self.n_next_pieces)]
+            self.drop_delay[i] = rng.randint(0, 3)
+
+
+    def _random_free_cells(self, idx):
+        """Draw a free cell for each game in idx, as
+        Board.ordered_random_free_cell does"""
+        free = (self.boards[idx] == Board.EMPTY).reshape(len(idx), -1)
+        k = np.array([self.rngs[i].randrange(n)
+                      for (i, n) in zip(idx, free.sum(axis=1))],
+                     dtype=np.int64)
+        #index of the k-th free cell
+        position = np.argmax(np.cumsum(free, axis=1) > k[:, None], axis=1)
+        return np.divmod(position, self.n_cols)
+
+
+    def path_lengths(self, src_rows, src_cols, dst_rows, dst_cols):
+        """Return, for every game, the length of the shortest path from src
+        to dst (-1 if there is none), by flooding all boards at the same
+        time.
+
+        >>> b = BatchGame([1, 2])
+        >>> b.boards[:] = Board.EMPTY
+        >>> b.boards[0, :, 2] = 1
+        >>> b.path_lengths(np.array([0, 0]), np.array([0, 0]),
+        ...                np.array([3, 3]), np.array([4, 4])).tolist()
+        [-1, 7]
+        """
+        n = len(src_rows)
+        everyone = np.arange(n)
+        free = self.boards == Board.EMPTY
+        reach = np.zeros_like(free)
+        reach[everyone, src_rows, src_cols] = True
+        lengths = np.full(n, -1, dtype=np.int64)
+        lengths[(src_rows == dst_rows) & (src_cols == dst_cols)] = 0
+        level = 0
+        while (lengths < 0).any():
+            level += 1
+            grown = reach.copy()
+            grown[:, 1:, :] |= reach[:, :-1, :]
+            grown[:, :-1, :] |= reach[:, 1:, :]
+            grown[:, :, 1:] |= reach[:, :, :-1]
+            grown[:, :, :-1] |= reach[:, :, 1:]
+            grown &= free
+            grown |= reach
+            if (grown == reach).all():
+                break
+            reach = grown
+            lengths[(lengths < 0) & reach[everyone, dst_rows, dst_cols]] = level
+        return lengths
+
+
+    def _clear_lines(self, idx, rows, cols):
+        """Remove the lines through (rows, cols) of the games in idx, as
+        Board.get_lines does, and update the scores. Return the number of
+        removed pieces for each game."""
+        n = len(idx)
+        local = np.arange(n)
+        boards = self.boards[idx]
+        v = boards[local, rows, cols]
+        clear = np.zeros(boards.shape, dtype=bool)
+        for (dr, dc) in AXES:
+            line = np.zeros(boards.shape, dtype=bool)
+            line[local, rows, cols] = True
+            count = np.ones(n, dtype=np.int64)
+            for sign in (1, -1):
+                alive = v != Board.EMPTY
+                for k in range(1, max(self.n_rows, self.n_cols)):
+                    r = rows + sign * k * dr
+                    c = cols + sign * k * dc
+                    alive &= (r >= 0) & (r < self.n_rows) & (c >= 0) & (c < self.n_cols)
+                    r = r.clip(0, self.n_rows - 1)
+                    c = c.clip(0, self.n_cols - 1)
+                    alive &= boards[local, r, c] == v
+                    if not alive.any():
+                        break
+                    line[local[alive], r[alive], c[alive]] = True
+                    count += alive
+            found = count >= Game.N_MATCH
+            clear[found] |= line[found]
+        boards[clear] = Board.EMPTY
+        self.boards[idx] = boards
+        n_matched = clear.sum(axis=(1, 2))
+        self.scores[idx] += self.score_table[n_matched]
+        return n_matched
+
+
+    def _fill_boards(self, idx):
+        """Drop the next pieces on the boards of the games in idx"""
+        for p in range(self.n_next_pieces):
+            #games with a full board stop dropping, and keep their queue
+            idx = idx[self.n_free()[idx] > 0]
+            if len(idx) == 0:
+                return
+            (rows, cols) = self._random_free_cells(idx)
+            self.boards[idx, rows, cols] = self.next_pieces[idx, p] + 1
+            self._clear_lines(idx, rows, cols)
+        self._generate_next_pieces(idx)
+
+
+    def make_moves(self, moves):
+        """Make a move in every game. moves is a (N, 4) array of
+        (start_row, start_col, end_row, end_col). Finished games, and
+        games whose move is impossible, are left unchanged.
+
+        Return a boolean array, True for the games where the move was made.
+        """
+        moves = np.asarray(moves, dtype=np.int64)
+        (src_rows, src_cols, dst_rows, dst_cols) = moves.T
+        lengths = self.path_lengths(src_rows, src_cols, dst_rows, dst_cols)
+        valid = (lengths > 0) & ~self.game_over()
+        idx = np.flatnonzero(valid)
+        if len(idx) == 0:
+            return valid
+        (src_rows, src_cols) = (src_rows[idx], src_cols[idx])
+        (dst_rows, dst_cols) = (dst_rows[idx], dst_cols[idx])
+        pieces = self.boards[idx, src_rows, src_cols]
+        self.boards[idx, src_rows, src_cols] = Board.EMPTY
+        self.boards[idx, dst_rows, dst_cols] = pieces
+        self.drop_delay[idx] -= lengths[idx]
+        n_matched = self._clear_lines(idx, dst_rows, dst_cols)
+        #in normal mode, nothing is dropped after a line is done
+        self._fill_boards(idx[n_matched == 0])
+        return valid
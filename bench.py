@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the hot paths of the game engine
+
+Usage:
+    bench.py [--output=<file>] [--compare=<file>] [--repeat=<n>] [--size=<s>...]
+    bench.py (-h | --help)
+
+Options:
+    -h, --help          Display help
+    --output=<file>     Write the results (JSON) to file [default: bench.json]
+    --compare=<file>    Compare the results with a previous run
+    --repeat=<n>        Number of timed repetitions [default: 5]
+    --size=<s>          Board size(s) to use: small, medium or large
+                        (default: all of them)
+"""
+
+import copy
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from random import Random
+
+from docopt import docopt
+
+from game import Game, Helper, BoardSize, Mode
+from player import heuristic_player, heuristic_2
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+#seed of the fixture games, and number of moves played before timing
+SEED = 1234
+N_MOVES = 10
+
+
+def fixture(size, mode):
+    """Return a game in the middle of its course: N_MOVES moves of
+    heuristic_2 from a fixed seed"""
+    g = Game(size, mode, SEED)
+    hp = Helper(g)
+    for i in range(N_MOVES):
+        if g.check_game_over():
+            break
+        hp.build_eval_cache()
+        (src, dst) = heuristic_2(hp, hp.actions())
+        g.make_move(src.row, src.col, dst.row, dst.col)
+    return g
+
+
+def timed(function, repeat, setup = None):
+    """Call function repeat times, return the list of durations (s).
+    If setup is given, its result is passed to function, and is not timed.
+    """
+    result = []
+    for i in range(repeat):
+        if setup is None:
+            start = time.perf_counter()
+            function()
+        else:
+            arg = setup()
+            start = time.perf_counter()
+            function(arg)
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def benchmarks(g, size):
+    """Return the list of (name, function, setup) to time on game g, of
+    board size size"""
+    b = g.board
+    rng = Random(SEED)
+    occupied = b.occupied_cells()
+    free = b.free_cells()
+    pairs = [(rng.choice(occupied), rng.choice(free)) for i in range(20)]
+    hp = Helper(g)
+    act = hp.actions()
+    moves = list(act.moves())
+    (src, dst) = rng.choice(moves)
+
+    def find_path():
+        for (s, d) in pairs:
+            b.find_path(s.row, s.col, d.row, d.col)
+
+    def get_all_directions():
+        for c in occupied:
+            c.get_all_directions(b.grid, Game.N_MATCH)
+
+    def make_move(game):
+        game.make_move(src.row, src.col, dst.row, dst.col)
+
+    def play_game(game):
+        heuristic_player(game, heuristic_2)
+
+    result = [("Board.find_path (x20)", find_path, None),
+              ("Board.free_cells", b.free_cells, None),
+              ("Cell.get_all_directions (all pieces)", get_all_directions, None),
+              ("Helper.__init__", lambda: Helper(g), None),
+              ("Helper.actions", hp.actions, None)]
+    for engine in (Helper.PYTHON, Helper.NUMPY, Helper.PATTERN):
+        try:
+            h = Helper(g, engine)
+        except ValueError:
+            continue
+        result.append(("Helper.build_eval_cache (%s)" % engine, h.build_eval_cache, None))
+    result.append(("Game.make_move", make_move, lambda: copy.deepcopy(g)))
+    result.append(("heuristic_player (complete game)", play_game,
+                   lambda: Game(size, g.mode, SEED)))
+    return result
+
+
+def run(sizes, repeat):
+    """Run all benchmarks, return the list of results"""
+    results = []
+    for size in sizes:
+        for mode in (Mode.NORMAL, Mode.DISTANCE):
+            g = fixture(size, mode)
+            for (name, function, setup) in benchmarks(g, size):
+                times = timed(function, repeat, setup)
+                results.append({'name': name,
+                                'size': size.name,
+                                'mode': mode,
+                                'repeat': repeat,
+                                'best': min(times),
+                                'mean': sum(times) / len(times)})
+                print("%-40s %-6s %-8s %10.3f ms" % (name, size.name, mode,
+                                                      1000 * min(times)))
+    return results
+
+
+def compare(results, previous):
+    """Print the ratio between the best times of results and previous"""
+    before = {(r['name'], r['size'], r['mode']): r['best'] for r in previous}
+    for r in results:
+        key = (r['name'], r['size'], r['mode'])
+        if key in before and before[key] > 0:
+            print("%-40s %-6s %-8s %6.2fx" % (r['name'], r['size'], r['mode'],
+                                              r['best'] / before[key]))
+
+
+if __name__=='__main__':
+    args = docopt(__doc__)
+    if args['--size']:
+        sizes = [BoardSize[s.upper()] for s in args['--size']]
+    else:
+        sizes = list(BoardSize)
+    if args['--compare']:
+        with open(args['--compare']) as f:
+            previous = json.load(f)['results']
+    results = run(sizes, int(args['--repeat']))
+    with open(args['--output'], 'w') as f:
+        json.dump({'timestamp': str(datetime.now()),
+                   'python': sys.version,
+                   'machine': platform.platform(),
+                   'seed': SEED,
+                   'results': results}, f, indent = 1)
+    if args['--compare']:
+        compare(results, previous)
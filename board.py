@@ -3,7 +3,11 @@
 """Board and Cells of the board
 """
 
+from collections import deque
 from enum import Enum, auto
+from functools import lru_cache
+from heapq import heappush, heappop
+from random import Random
 
 
 __author__="Rémi Pannequin"
@@ -14,8 +18,42 @@ __maintainer__ = "Rémi Pannequin"
 __email__ = "remi.pannequin@gmail.com"
 __status__ = "Development"
 
+@lru_cache(maxsize = None)
+def _adjacency (n_rows, n_cols):
+    """Orthogonal neighbours of every index of a n_rows x n_cols board,
+    in the order right, left, up, down. Shared by all boards of that shape.
+    """
+    result = []
+    for row in range(n_rows):
+        for col in range(n_cols):
+            n = []
+            if col + 1 < n_cols:
+                n.append(row * n_cols + col + 1)
+            if col > 0:
+                n.append(row * n_cols + col - 1)
+            if row > 0:
+                n.append((row - 1) * n_cols + col)
+            if row + 1 < n_rows:
+                n.append((row + 1) * n_cols + col)
+            result.append(tuple(n))
+    return tuple(result)
+
+
+@lru_cache(maxsize = None)
+def zobrist_keys (n_cells, value):
+    """Random 64 bits keys of a piece value on each of n_cells cells.
+    Keys are the same for every board (and every run).
+    """
+    rng = Random(n_cells * 1000003 + value)
+    return tuple(rng.getrandbits(64) for i in range(n_cells))
+
+
 class Board:
 
+    #value stored in the piece buffer for an empty square, pieces are
+    #stored as piece + 1
+    EMPTY = 0
+
     def __init__(self, n_rows, n_cols):
         """Create a new board
         
@@ -30,10 +68,74 @@ class Board:
         7
         >>> [len(row) for row in b.grid]
         [9, 9, 9, 9, 9, 9, 9]
+        >>> len(b.pieces)
+        63
         """
         self.n_rows = n_rows
         self.n_cols = n_cols
-        self.grid = [[Cell(row, col) for col in range(n_cols)] for row in range(n_rows)]
+        self.n_cells = n_rows * n_cols
+        #flat piece buffer, indexed by row * n_cols + col
+        self.pieces = bytearray(self.n_cells)
+        #index of free cells: unordered array of free indices, position of
+        #each index in that array (-1 if occupied), free count per row
+        self._free = list(range(self.n_cells))
+        self._free_pos = list(range(self.n_cells))
+        self._row_free = [n_cols] * n_rows
+        #bitboards: one int per stored piece value, with bit
+        #row * (n_cols + 1) + col set for each piece. The extra (always
+        #empty) column stops shifted lines from wrapping to the next row
+        self._bits = dict()
+        #Zobrist hash of the content of the board
+        self.hash = 0
+        #Cell views, only created when the object API is used
+        self._cells = None
+        self._grid = None
+        #path search data, allocated on first use
+        self._adjacent = None
+        #free regions: label of each index (-1 if occupied), and set of
+        #indices of each label. Computed on first use, then kept up to date
+        self._label = None
+        self._regions = None
+        self._next_label = 0
+        #instrumentation (instrument.Stats), None when disabled
+        self.stats = None
+
+
+    def index (self, row, col):
+        """Return the index of (row, col) in the piece buffer
+        
+        >>> b = Board(7, 9)
+        >>> b.index(2, 3)
+        21
+        """
+        return row * self.n_cols + col
+
+
+    def cells (self):
+        """Return the (cached) list of cell views, in buffer order
+        
+        >>> b = Board(3, 4)
+        >>> c = b.cells()
+        >>> c[5]
+        Cell(1, 1)
+        >>> c is b.cells()
+        True
+        """
+        if self._cells is None:
+            n_cols = self.n_cols
+            self._cells = [Cell(i // n_cols, i % n_cols, board = self)
+                           for i in range(self.n_cells)]
+        return self._cells
+
+
+    @property
+    def grid (self):
+        if self._grid is None:
+            cells = self.cells()
+            n_cols = self.n_cols
+            self._grid = [cells[r * n_cols:(r + 1) * n_cols]
+                          for r in range(self.n_rows)]
+        return self._grid
 
 
     def print(self):
@@ -58,11 +160,11 @@ class Board:
         | | | | | | | | | |
         | | | | | | | | | |
         """
-        for row in self.grid:
+        for r in range(self.n_rows):
             p = []
-            for c in row:
-                if c.piece:
-                    p.append("%d"%c.piece)
+            for v in self.pieces[r * self.n_cols:(r + 1) * self.n_cols]:
+                if v > 1:
+                    p.append("%d"%(v - 1))
                 else:
                     p.append(" ")
             print("|"+"|".join(p)+"|")
@@ -80,10 +182,175 @@ class Board:
         >>> b.set_piece(3, 7, p)
         >>> b.grid[3][7].piece
         3
+        >>> b.pieces[b.index(3, 7)]
+        4
+        >>> h = b.hash
+        >>> b.set_piece(3, 7, None)
+        >>> b.hash
+        0
+        >>> b.set_piece(3, 7, p)
+        >>> b.hash == h
+        True
         """
+        i = row * self.n_cols + col
+        old = self.pieces[i]
+        was_free = old == Board.EMPTY
         if piece:
-            assert self.grid[row][col].piece == None
-        self.grid[row][col].piece = piece
+            assert was_free
+        bit = 1 << (row * (self.n_cols + 1) + col)
+        if not was_free:
+            self._bits[old] &= ~bit
+            self.hash ^= zobrist_keys(self.n_cells, old)[i]
+        if piece is not None:
+            self._bits[piece + 1] = self._bits.get(piece + 1, 0) | bit
+            self.hash ^= zobrist_keys(self.n_cells, piece + 1)[i]
+        if piece is None:
+            self.pieces[i] = Board.EMPTY
+            if not was_free:
+                self._free_pos[i] = len(self._free)
+                self._free.append(i)
+                self._row_free[row] += 1
+        else:
+            self.pieces[i] = piece + 1
+            if was_free:
+                #swap-remove i from the free array
+                pos = self._free_pos[i]
+                last = self._free.pop()
+                if last != i:
+                    self._free[pos] = last
+                    self._free_pos[last] = pos
+                self._free_pos[i] = -1
+                self._row_free[row] -= 1
+        if self._label is not None:
+            if was_free and piece is not None:
+                self._occupy(i)
+            elif not was_free and piece is None:
+                self._vacate(i)
+
+
+    def copy (self):
+        """Return a copy of the board (the cell views and the path search
+        buffers are not copied, they are created again when needed).
+        
+        >>> b = Board(3, 3)
+        >>> b.set_piece(1, 1, 2)
+        >>> c = b.copy()
+        >>> c.set_piece(0, 0, 1)
+        >>> (b.n_free(), c.n_free(), c.get_piece(1, 1))
+        (8, 7, 2)
+        """
+        result = Board.__new__(Board)
+        result.__dict__.update(self.__dict__)
+        result.pieces = bytearray(self.pieces)
+        result._free = list(self._free)
+        result._free_pos = list(self._free_pos)
+        result._row_free = list(self._row_free)
+        result._bits = dict(self._bits)
+        result._cells = None
+        result._grid = None
+        result._adjacent = None
+        result._label = None
+        result._regions = None
+        result.stats = None
+        return result
+
+
+    def load (self, pieces):
+        """Replace the content of the board by pieces (in the piece buffer
+        encoding), keeping the indices up to date.
+        
+        >>> b = Board(3, 3)
+        >>> b.set_piece(0, 0, 2)
+        >>> b.load(bytes([0, 1, 0, 0, 0, 0, 0, 0, 4]))
+        >>> (b.get_piece(0, 0), b.get_piece(0, 1), b.get_piece(2, 2), b.n_free())
+        (None, 0, 3, 7)
+        """
+        #regions are labelled again when needed
+        self._label = None
+        self._regions = None
+        for (i, v) in enumerate(pieces):
+            if self.pieces[i] != v:
+                (row, col) = divmod(i, self.n_cols)
+                self.set_piece(row, col, None)
+                if v != Board.EMPTY:
+                    self.set_piece(row, col, v - 1)
+
+
+    def n_free (self):
+        """Return the number of free cells
+        
+        >>> b = Board(4, 4)
+        >>> b.n_free()
+        16
+        >>> b.set_piece(1, 2, 0)
+        >>> b.set_piece(3, 3, 1)
+        >>> b.n_free()
+        14
+        >>> b.set_piece(1, 2, None)
+        >>> b.n_free()
+        15
+        """
+        return len(self._free)
+
+
+    def n_occupied (self):
+        """Return the number of occupied cells"""
+        return self.n_cells - len(self._free)
+
+
+    def random_free_cell (self, rng):
+        """Return a free cell drawn uniformly with rng, in constant time.
+        
+        >>> from random import Random
+        >>> b = Board(4, 4)
+        >>> for (r, c) in [(0, 0), (1, 1), (2, 2)]:
+        ...     b.set_piece(r, c, 1)
+        >>> rng = Random(3)
+        >>> cells = [b.random_free_cell(rng) for i in range(100)]
+        >>> any(c.piece is not None for c in cells)
+        False
+        """
+        return self.cells()[self._free[rng.randrange(len(self._free))]]
+
+
+    def nth_free_cell (self, k):
+        """Return the k-th free cell, in row-major order: this is
+        free_cells()[k], without building the list.
+        
+        >>> b = Board(4, 4)
+        >>> b.set_piece(0, 1, 1)
+        >>> b.set_piece(2, 0, 1)
+        >>> [b.nth_free_cell(k) for k in range(b.n_free())] == b.free_cells()
+        True
+        """
+        row = 0
+        while k >= self._row_free[row]:
+            k -= self._row_free[row]
+            row += 1
+        i = row * self.n_cols
+        pieces = self.pieces
+        while True:
+            i = pieces.find(Board.EMPTY, i)
+            if k == 0:
+                return self.cells()[i]
+            k -= 1
+            i += 1
+
+
+    def ordered_random_free_cell (self, rng):
+        """Return a free cell drawn with rng, the same way as
+        rng.choice(self.free_cells()) would.
+        
+        >>> from random import Random
+        >>> b = Board(5, 5)
+        >>> b.set_piece(0, 1, 1)
+        >>> b.set_piece(3, 2, 1)
+        >>> (r1, r2) = (Random(7), Random(7))
+        >>> all(b.ordered_random_free_cell(r1) == r2.choice(b.free_cells())
+        ...     for i in range(50))
+        True
+        """
+        return self.nth_free_cell(rng.randrange(len(self._free)))
 
 
     def get_piece (self, row, col):
@@ -96,7 +363,10 @@ class Board:
         >>> b.get_piece(0, 0)
         1
         """
-        return self.grid[row][col].piece
+        v = self.pieces[row * self.n_cols + col]
+        if v == Board.EMPTY:
+            return None
+        return v - 1
 
 
     def get_cell (self, row, col):
@@ -104,7 +374,7 @@ class Board:
         assert(row < self.n_rows)
         assert(col >= 0)
         assert(col < self.n_cols)
-        return self.grid[row][col]
+        return self.cells()[row * self.n_cols + col]
 
 
     def all_cells(self):
@@ -115,7 +385,7 @@ class Board:
         16
         
         """
-        return  [c for row in self.grid for c in row]
+        return list(self.cells())
 
 
     def occupied_cells(self):
@@ -135,7 +405,8 @@ class Board:
         (1, 1, 2)
         
         """
-        return [c for c in self.all_cells() if c.piece is not None]
+        cells = self.cells()
+        return [cells[i] for i, v in enumerate(self.pieces) if v != Board.EMPTY]
 
 
     def free_cells(self):
@@ -151,7 +422,8 @@ class Board:
         False
         
         """
-        return [c for c in self.all_cells() if c.piece is None]
+        cells = self.cells()
+        return [cells[i] for i, v in enumerate(self.pieces) if v == Board.EMPTY]
 
 
     def find_path (self, 
@@ -185,79 +457,359 @@ class Board:
         []
         
         """
-        self._reset_path_search()
-        src = self.grid[start_row][start_col]
-        dst = self.grid[end_row][end_col]
-        closed = list()
-        open = list()
-        open.append(src)
-        current_cell = None
-        current_cost = 0
-        path = []
-        
-        while len(open) != 0:
-            current_cost = len(closed)
-
-            current_cell = Board.best_candidate (open, current_cost, dst)
-            closed.append(current_cell)
-            open.remove (current_cell)
-
-            if dst in closed:
-                p = dst;
-                while p.parent:
-                    path.insert (0, p)
-                    p = p.parent
+        n_cols = self.n_cols
+        src = start_row * n_cols + start_col
+        dst = end_row * n_cols + end_col
+        if src == dst:
+            return []
+        if self._label is not None and not self.reachable(start_row, start_col, end_row, end_col):
+            return []
+        pieces = self.pieces
+        adjacent = self._get_adjacent()
+        #scratch buffers: an entry is only valid if its stamp is the
+        #current generation, so nothing needs to be reset between calls
+        cost = self._path_cost
+        parent = self._path_parent
+        seen = self._path_seen
+        closed = self._path_closed
+        self._path_generation += 1
+        gen = self._path_generation
+        
+        seen[src] = gen
+        cost[src] = 0
+        parent[src] = -1
+        h = Board.manhattan (start_row, start_col, end_row, end_col)
+        count = 0
+        expanded = 0
+        open = [(h, h, count, src)]
+        while open:
+            (f, h, _, current) = heappop (open)
+            if closed[current] == gen:
+                #outdated entry
+                continue
+            closed[current] = gen
+            expanded += 1
+            
+            if current == dst:
+                if self.stats is not None:
+                    self.stats.count('path_expansions', expanded)
+                cells = self.cells()
+                path = []
+                while current != src:
+                    path.append(cells[current])
+                    current = parent[current]
+                path.reverse()
                 return path
-
-            neighbours = current_cell.get_neighbours_free (self.grid)
-            for neighbour in neighbours:
-                # if self adjacent square is already in the closed list ignore it
-                if neighbour in closed:
+            
+            g = cost[current] + 1
+            for neighbour in adjacent[current]:
+                if pieces[neighbour] != Board.EMPTY or closed[neighbour] == gen:
                     continue
+                if seen[neighbour] != gen or g < cost[neighbour]:
+                    seen[neighbour] = gen
+                    cost[neighbour] = g
+                    parent[neighbour] = current
+                    (row, col) = divmod(neighbour, n_cols)
+                    h = Board.manhattan (row, col, end_row, end_col)
+                    count += 1
+                    heappush (open, (g + h, h, count, neighbour))
+        if self.stats is not None:
+            self.stats.count('path_expansions', expanded)
+        return []
+
+
+    def get_lines (self, row, col, n_match):
+        """Return the set of cells in the horizontal, vertical or diagonal
+        lines through (row, col) that are made of at least n_match pieces
+        of the same type.
+        
+        >>> b = Board(7, 7)
+        >>> for col in range(5):
+        ...     b.set_piece(2, col, 3)
+        >>> b.set_piece(3, 1, 3)
+        >>> b.set_piece(4, 0, 3)
+        >>> sorted(b.get_lines(2, 4, 5), key = lambda c: (c.row, c.col))
+        [Cell(2, 0), Cell(2, 1), Cell(2, 2), Cell(2, 3), Cell(2, 4)]
+        >>> len(b.get_lines(2, 2, 3))
+        7
+        >>> b.get_lines(0, 0, 5)
+        set()
+        """
+        if self.stats is not None:
+            self.stats.count('line_checks')
+        v = self.pieces[row * self.n_cols + col]
+        if v == Board.EMPTY:
+            return set()
+        mask = self._bits[v]
+        width = self.n_cols + 1
+        bit = 1 << (row * width + col)
+        lines = 0
+        for shift in (1, width, width + 1, width - 1):
+            #grow the line from bit, in both ways
+            line = bit
+            x = bit << shift
+            while x & mask:
+                line |= x
+                x <<= shift
+            x = bit >> shift
+            while x & mask:
+                line |= x
+                x >>= shift
+            if line.bit_count() >= n_match:
+                lines |= line
+        cells = self.cells()
+        result = set()
+        while lines:
+            low = lines & -lines
+            (r, c) = divmod(low.bit_length() - 1, width)
+            result.add(cells[r * self.n_cols + c])
+            lines ^= low
+        return result
+
+
+    def distance_map (self, row, col):
+        """Return the length of the shortest path from (row, col) to every
+        cell, as a list indexed like the piece buffer. Cells that cannot be
+        reached are set to -1.
 
-                # if its not in the open list add it
-                if neighbour not in open:
-                    neighbour.parent = current_cell
-                    open.append(neighbour)
+        >>> b = Board(3, 5)
+        >>> b.set_piece(0, 3, 1)
+        >>> b.set_piece(1, 3, 1)
+        >>> b.set_piece(2, 2, 1)
+        >>> d = b.distance_map(1, 0)
+        >>> [d[b.index(1, c)] for c in range(5)]
+        [0, 1, 2, -1, -1]
+        >>> d[b.index(2, 4)]
+        -1
+        >>> d = b.distance_map(2, 4)
+        >>> [d[b.index(r, 4)] for r in range(3)]
+        [2, 1, 0]
+        """
+        pieces = self.pieces
+        adjacent = self._get_adjacent()
+        src = row * self.n_cols + col
+        dist = [-1] * self.n_cells
+        dist[src] = 0
+        queue = [src]
+        for current in queue:
+            d = dist[current] + 1
+            for neighbour in adjacent[current]:
+                if dist[neighbour] < 0 and pieces[neighbour] == Board.EMPTY:
+                    dist[neighbour] = d
+                    queue.append(neighbour)
+        if self.stats is not None:
+            self.stats.count('flood_visits', len(queue))
+        return dist
+
+
+    def path_from_map (self, dist, end_row, end_col):
+        """Return a shortest path to (end_row, end_col), given the distance
+        map of its source (see distance_map). The path has the same form
+        as the one returned by find_path.
 
-                # if its already in the open list and using the current score makes it lower,
-                # update the parent because it means it is a better path
-                else:
-                    if Board.total_cost (neighbour, dst, current_cost) < neighbour.cost:
-                        neighbour.parent = current_cell
-                        neighbour.cost = total_cost (neighbour, dst, current_cost)
+        >>> b = Board(3, 5)
+        >>> b.set_piece(0, 3, 1)
+        >>> b.set_piece(2, 3, 1)
+        >>> d = b.distance_map(1, 0)
+        >>> b.path_from_map(d, 1, 4)
+        [Cell(1, 1), Cell(1, 2), Cell(1, 3), Cell(1, 4)]
+        >>> b.path_from_map(d, 1, 0)
+        []
+        >>> b.set_piece(1, 3, 1)
+        >>> b.path_from_map(b.distance_map(0, 0), 2, 4)
+        []
+        """
+        current = end_row * self.n_cols + end_col
+        d = dist[current]
+        if d <= 0:
+            return []
+        adjacent = self._get_adjacent()
+        cells = self.cells()
+        path = [None] * d
+        while d > 0:
+            path[d - 1] = cells[current]
+            d -= 1
+            for neighbour in adjacent[current]:
+                if dist[neighbour] == d:
+                    current = neighbour
+                    break
         return path
 
 
-    def cell_equal (a, b):
-        if a and b:
-            return a == b
-        return false
+    def _get_labels (self):
+        """Return the label of the free region of each index (-1 for an
+        occupied cell). Regions are labelled on the first call, then
+        set_piece keeps them up to date.
+        
+        >>> b = Board(3, 3)
+        >>> for row in range(3):
+        ...     b.set_piece(row, 1, 1)
+        >>> b._get_labels()
+        [0, -1, 1, 0, -1, 1, 0, -1, 1]
+        """
+        if self._label is None:
+            adjacent = self._get_adjacent()
+            pieces = self.pieces
+            label = [-1] * self.n_cells
+            self._regions = dict()
+            self._next_label = 0
+            for i in range(self.n_cells):
+                if pieces[i] != Board.EMPTY or label[i] >= 0:
+                    continue
+                r = self._next_label
+                self._next_label += 1
+                label[i] = r
+                members = {i}
+                stack = [i]
+                while stack:
+                    j = stack.pop()
+                    for k in adjacent[j]:
+                        if pieces[k] == Board.EMPTY and label[k] < 0:
+                            label[k] = r
+                            members.add(k)
+                            stack.append(k)
+                self._regions[r] = members
+            self._label = label
+        return self._label
+
+
+    def _occupy (self, i):
+        """Update the regions after a piece was put at index i: the region
+        of i may be split"""
+        label = self._label
+        r = label[i]
+        label[i] = -1
+        members = self._regions[r]
+        members.discard(i)
+        if not members:
+            del self._regions[r]
+            return
+        pieces = self.pieces
+        starts = [k for k in self._adjacent[i] if pieces[k] == Board.EMPTY]
+        #flood from a free neighbour until the others are found again (the
+        #region is still connected, usually around i), or until its whole
+        #part is found: it is then a new region
+        while len(starts) > 1:
+            targets = set(starts[1:])
+            seen = {starts[0]}
+            queue = deque(seen)
+            while queue and targets:
+                j = queue.popleft()
+                for k in self._adjacent[j]:
+                    if pieces[k] == Board.EMPTY and k not in seen:
+                        seen.add(k)
+                        targets.discard(k)
+                        queue.append(k)
+            if not targets:
+                return
+            new = self._next_label
+            self._next_label += 1
+            for k in seen:
+                label[k] = new
+            members -= seen
+            self._regions[new] = seen
+            starts = [k for k in starts if k not in seen]
+
+
+    def _vacate (self, i):
+        """Update the regions after index i was freed: it joins (and merges)
+        the regions around it"""
+        label = self._label
+        near = set(label[k] for k in self._adjacent[i] if label[k] >= 0)
+        if not near:
+            r = self._next_label
+            self._next_label += 1
+            self._regions[r] = set()
+        else:
+            #smaller regions are merged into the biggest one
+            r = max(near, key = lambda l: len(self._regions[l]))
+            for l in near:
+                if l != r:
+                    merged = self._regions.pop(l)
+                    for k in merged:
+                        label[k] = r
+                    self._regions[r] |= merged
+        label[i] = r
+        self._regions[r].add(i)
+
+
+    def region (self, row, col):
+        """Return the set of the indices of the free region of (row, col),
+        or an empty set if it is occupied. The set belongs to the board,
+        and must not be changed.
+        
+        >>> b = Board(3, 3)
+        >>> for row in range(3):
+        ...     b.set_piece(row, 1, 1)
+        >>> sorted(b.region(0, 2))
+        [2, 5, 8]
+        >>> b.set_piece(1, 1, None)
+        >>> len(b.region(0, 2))
+        7
+        >>> b.set_piece(1, 0, 2)
+        >>> sorted(b.region(0, 0))
+        [0]
+        >>> b.region(1, 0)
+        frozenset()
+        """
+        r = self._get_labels()[row * self.n_cols + col]
+        if r < 0:
+            return frozenset()
+        return self._regions[r]
 
 
-    def _reset_path_search (self):
-        for row in self.grid:
-            for cell in row:
-                cell.parent = None
-                cell.cost = float('+Inf')
-                
-                
-    def best_candidate (neighbours, current_cost, end):
-        """f = g + h, where f is the cost of the road
-        g is the movement cost from the start cell to the current square
-        h is the estimated movement cost from the current square to the destination cell
+    def reachable (self, from_row, from_col, to_row, to_col):
+        """Return True if a piece at (from_row, from_col) can move to
+        (to_row, to_col), i.e. the destination is free and in a region
+        next to the source (or in its region).
+        
+        >>> b = Board(3, 5)
+        >>> for row in range(3):
+        ...     b.set_piece(row, 3, 1)
+        >>> (b.reachable(0, 0, 2, 2), b.reachable(0, 3, 2, 4), b.reachable(0, 0, 2, 4))
+        (True, True, False)
+        >>> b.reachable(0, 0, 0, 0)
+        False
         """
-        lowest_f = float('inf')
-        best_candidate = None
+        label = self._get_labels()
+        src = from_row * self.n_cols + from_col
+        dst = to_row * self.n_cols + to_col
+        r = label[dst]
+        if r < 0 or src == dst:
+            return False
+        if label[src] == r:
+            return True
+        for k in self._adjacent[src]:
+            if label[k] == r:
+                return True
+        return False
 
-        for neighbour in neighbours:
-            neighbour.cost = Board.total_cost (neighbour, end, current_cost)
 
-            if neighbour.cost < lowest_f:
-                lowest_f = neighbour.cost
-                best_candidate = neighbour
+    def _get_adjacent (self):
+        """Return, for each index, the indices of its orthogonal neighbours
+        (right, left, up, down). Also allocate the path search buffers.
+        
+        >>> b = Board(3, 4)
+        >>> b._get_adjacent()[0]
+        (1, 4)
+        >>> b._get_adjacent()[5]
+        (6, 4, 1, 9)
+        """
+        if self._adjacent is None:
+            self._adjacent = _adjacency (self.n_rows, self.n_cols)
+            n = self.n_cells
+            self._path_cost = [0] * n
+            self._path_parent = [-1] * n
+            self._path_seen = [0] * n
+            self._path_closed = [0] * n
+            self._path_generation = 0
+        return self._adjacent
 
-        return best_candidate
+
+    def cell_equal (a, b):
+        if a and b:
+            return a == b
+        return false
 
 
     def manhattan (start_x, start_y, end_x, end_y):
@@ -269,23 +821,59 @@ class Board:
         return abs(start_x - end_x) + abs(start_y - end_y)
 
 
-    def total_cost (start, end, current_cost):
-        g = current_cost + 1
-        h = Board.manhattan (start.row, start.col, end.row, end.col)
-        f = g + h
-        return f
-
 
 class Cell:
-
-    def __init__(self, row, col, parent = None, piece = None):
+    """A square of the board.
+    
+    Cells created by a Board are views on its piece buffer: the piece is
+    read from (and written to) the board, only the coordinates and the
+    path search data are kept in the cell. Each access to piece goes
+    through the buffer, so loops over many cells should rather read
+    board.pieces by index.
+    
+    >>> b = Board(3, 3)
+    >>> c = b.get_cell(1, 2)
+    >>> c.piece is None
+    True
+    >>> b.set_piece(1, 2, 4)
+    >>> c.piece
+    4
+    >>> Cell(1, 2, piece = 0).piece
+    0
+    """
+
+    __slots__ = ('row', 'col', 'parent', 'cost', '_board', '_piece')
+
+    def __init__(self, row, col, parent = None, piece = None, board = None):
         self.row = row
         self.col = col
         self.parent = parent
-        self.piece = piece
+        self._board = board
+        self._piece = None
+        if piece is not None:
+            self.piece = piece
         self.cost = float('inf')
 
 
+    @property
+    def piece(self):
+        b = self._board
+        if b is None:
+            return self._piece
+        v = b.pieces[self.row * b.n_cols + self.col]
+        if v == Board.EMPTY:
+            return None
+        return v - 1
+
+
+    @piece.setter
+    def piece(self, piece):
+        if self._board is None:
+            self._piece = piece
+        else:
+            self._board.set_piece(self.row, self.col, piece)
+
+
     def __eq__(self, cell):
         if cell:
             return self.row == cell.row and self.col == cell.col
@@ -293,7 +881,9 @@ class Cell:
 
 
     def __hash__(self):
-        return hash(self.row) + hash(self.col)
+        #distinct for every cell of a board (row + col collides on
+        #anti-diagonals)
+        return (self.row << 16) + self.col
 
 
     def __repr__(self):
@@ -396,7 +986,8 @@ class Cell:
         if l is None:
             l = set()
         cell = self
-        while cell and cell.piece != None and cell.piece == self.piece:
+        piece = self.piece
+        while cell and piece != None and cell.piece == piece:
             l.add(cell)
             cell = cell.get_neighbour (board, dir)
         return l
@@ -443,6 +1034,8 @@ class Cell:
         [1, 1, 1, 1]
         
         """
+        if self._board is not None:
+            return self._board.get_lines(self.row, self.col, n_match)
         inactivate = set()
 
         l = self._get_horizontal (board)
@@ -3,7 +3,7 @@
 """Interactive interface for the game and automatic player agent
 
 Usage:
-    fiver.py [--seed=<n>] [--mode=<m>] [-t | --show-tip]
+    fiver.py [--seed=<n>] [--mode=<m>] [-t | --show-tip] [-l | --lookahead]
     fiver.py (-h | --help | --version)
     
 Options:
@@ -11,17 +11,17 @@ Options:
     --seed=<n>      Random seed to use
     --mode=<m>      The playing mode to use [default: normal] 
     -t, --show-tip  Show playing tip
+    -l, --lookahead Compute the tip with a lookahead search
 """
 
-import shelve
-from datetime import datetime
 import sys
 
 from docopt import docopt
 import pygame
 
-from game import Game, Helper
-from player import step, heuristic_2
+from game import Game
+from player import heuristic_2, Expectimax, MoveWorker
+from tracedb import TraceDB
 
 _author__="Julien Noel and Rémi Pannequin"
 __copyright__ = "Copyright 2020"
@@ -39,7 +39,10 @@ COULEUR = [pygame.Color(x) for x in ["#3465a4", "#ef2929", "#c4a000", "#f57900",
 
 class Window:
 
-    def __init__(self, seed = None, mode=None, show_tip = False):
+    #time of the tip search (in background)
+    TIP_BUDGET = 0.5
+
+    def __init__(self, seed = None, mode=None, show_tip = False, lookahead = False):
         pygame.init()
         pygame.font.init()
         #variables
@@ -48,9 +51,15 @@ class Window:
         else:
             self.mode = Game.Mode.NORMAL
         self.selection = None
+        #tips and automatic moves are computed in background
+        self.worker = MoveWorker()
         self.reset(seed)
         self.compute_size()
         self.show_tip = show_tip
+        if lookahead:
+            self.tip_player = Expectimax(depth = 4, budget = Window.TIP_BUDGET)
+        else:
+            self.tip_player = heuristic_2
 
 
     def compute_size(self):
@@ -65,7 +74,8 @@ class Window:
     def reset(self, seed=None):
         self.game_over = False
         self.g = Game(seed = seed, mode = self.mode)
-        self.hp = Helper(self.g)
+        self.proposition = None
+        self.step_requested = False
 
 
     def pix(self, r):
@@ -77,10 +87,22 @@ class Window:
 
     def estimate_best_move(self):
         if self.game_over is False :    
-            actions = self.hp.actions()
-            #Estimate best move (destination)
-            (src, dst) = heuristic_2(self.hp, actions)
-            self.proposition = (dst.row, dst.col, src.piece)
+            #Estimate best move (destination). Until it is known, the
+            #previous tip is kept
+            move = self.worker.request(self.g, self.tip_player)
+            if move is not None:
+                (src_row, src_col, dst_row, dst_col, piece) = move
+                self.proposition = (dst_row, dst_col, piece)
+
+
+    def play_step(self):
+        """Play the automatic move asked with the space bar, as soon as it
+        is known"""
+        if self.step_requested and not self.game_over:
+            move = self.worker.request(self.g, heuristic_2)
+            if move is not None:
+                self.g.make_move(*move[:4])
+                self.step_requested = False
 
     def text_centered(self, msg, x, y, big=False):
         if big:
@@ -132,7 +154,7 @@ class Window:
                     [self.pix(0), self.pix(row)],
                     [self.pix(self.g.n_cols), self.pix(row)])
         
-        if not self.game_over and self.show_tip:
+        if not self.game_over and self.show_tip and self.proposition is not None:
             border = round(self.l/25)
             pygame.draw.rect(self.win, 
                              COULEUR[self.proposition[2]], 
@@ -193,19 +215,12 @@ class Window:
                                 print("No path to move here.")
                             else:
                                 self.g.make_move(self.selection[0], self.selection[1], row, col)
-                                
-                                
-                                
-                                
-                                #Rebuild cache only if game change
-                                self.hp.build_eval_cache()
                         self.selection = None
                 elif self.replay_bt.collidepoint(event.pos):
                     self.reset()
                 
             elif event.type == pygame.KEYDOWN and event.key == 32 and not self.game_over:
-                step(self.g)
-                self.hp.build_eval_cache()
+                self.step_requested = True
 
     def loop(self):
         clock = pygame.time.Clock()
@@ -214,15 +229,11 @@ class Window:
                 self.estimate_best_move()
             self.draw_game()
             self.process_events()
+            self.play_step()
             if not self.game_over and self.g.check_game_over():
                 self.game_over = True
-                with shelve.open('trace.db') as db:
-                    ts = datetime.now()
-                    db[str(ts)] = {'trace': self.g.trace, 
-                                   'size':(self.g.n_rows,self.g.n_cols), 
-                                   'mode':self.g.mode, 
-                                   'score':self.g.score,
-                                   'seed': self.g.seed}
+                with TraceDB('trace.db') as db:
+                    db.add(self.g)
             # Actualisation de l'affichage
             pygame.display.flip() 
             # 10 fps
@@ -242,7 +253,7 @@ if __name__=='__main__':
     else:
         m = 'normal'
     t = args['--show-tip']
-    w = Window(seed = s, mode = m, show_tip = t)
+    w = Window(seed = s, mode = m, show_tip = t, lookahead = args['--lookahead'])
     w.loop()
     
     
@@ -4,11 +4,23 @@
 """
 
 import sys
+import copy
 from random import Random, randrange
 from enum import Enum
+from time import perf_counter
 import math
+from collections.abc import Mapping
+from functools import lru_cache
+from heapq import heapify, heappop, heappush, heapreplace
 
-from board import Board, Direction
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from board import Board, Direction, zobrist_keys
+from instrument import Stats
+from gametrace import Trace
 
 __author__="Rémi Pannequin"
 __copyright__ = "Copyright 2020"
@@ -94,9 +106,20 @@ class Game:
                   BoardSize.MEDIUM: ( 9, 9, 7, 3 ),
                   BoardSize.LARGE: ( 20, 15, 7, 7 ) }
 
-    def __init__(self, size = BoardSize.SMALL, mode = Mode.NORMAL, seed=None):
+    def __init__(self, size = BoardSize.SMALL, mode = Mode.NORMAL, seed=None,
+                 legacy_sampling = True):
         """Create new instance of a five-or-more game.
+        
+        If legacy_sampling is True, free cells are drawn in the same way as
+        previous versions did, so that a seed always gives the same game.
+        Otherwise, they are drawn in constant time (but games differ).
+        
         >>> g = Game(BoardSize.SMALL)
+        >>> g.n_filled_cells
+        3
+        >>> g = Game(BoardSize.SMALL, seed = 5, legacy_sampling = False)
+        >>> g.n_filled_cells
+        3
         """
         self.mode = mode
         self.n_rows = Game.DIFFICULTY[size][0]
@@ -109,7 +132,7 @@ class Game:
             self.seed = randrange(sys.maxsize)
         self.rng = Random(self.seed)
         self.n_cells = self.n_rows * self.n_cols
-        self.n_filled_cells = 0
+        self.legacy_sampling = legacy_sampling
         self.score = 0
         self.next_pieces_queue = []
         #if normal mode:
@@ -125,12 +148,215 @@ class Game:
         self.drop_delay = 0
         self.generate_next_pieces ()
         self.board = Board (self.n_rows, self.n_cols)
+        #cells (row, col) changed by the last move (incl. drops and lines)
+        self.last_changes = set()
+        #instrumentation, see enable_stats
+        self.stats = None
+        #undo stack of apply: (changed cells, state before the move)
+        self._undo = []
+        self.trace = Trace(self.n_rows, self.n_cols)
+        #indices of the cells changed since the last recorded step
+        self._trace_changes = set()
         self.init_board (3)
-        self.trace = []
         self.last_move = None
+        #moves asked to make_move (and possible)
+        self.moves = []
         self.record_trace()
 
 
+    def enable_stats(self):
+        """Start recording counters and timers of the engine, in a new
+        instrument.Stats (self.stats) shared with the board.
+        
+        >>> g = Game(seed = 3)
+        >>> s = g.enable_stats()
+        >>> (src, dst) = (g.board.occupied_cells()[0], g.board.free_cells()[-1])
+        >>> g.make_move(src.row, src.col, dst.row, dst.col)
+        >>> s.counters['path_expansions'] > 0
+        True
+        >>> sorted(s.timers)
+        ['fill_board', 'match', 'move', 'pathfinding', 'record_trace']
+        >>> len(s.export()['moves'])
+        1
+        >>> g.disable_stats()
+        >>> g.stats is None
+        True
+        """
+        self.stats = Stats()
+        self.board.stats = self.stats
+        return self.stats
+
+
+    def disable_stats(self):
+        self.stats = None
+        self.board.stats = None
+
+
+    def snapshot(self):
+        """Return the state of the game (board, random generator, score,
+        next pieces...), to be given to restore. The trace is not included.
+        
+        >>> g = Game(seed = 8)
+        >>> s = g.snapshot()
+        >>> (src, dst) = (g.board.occupied_cells()[0], g.board.free_cells()[-1])
+        >>> g.make_move(src.row, src.col, dst.row, dst.col)
+        >>> g.restore(s)
+        >>> h = Game(seed = 8)
+        >>> (g.board.pieces, g.next_pieces_queue, g.score) == (h.board.pieces, h.next_pieces_queue, h.score)
+        True
+        >>> g.rng.random() == h.rng.random()
+        True
+        
+        The trace goes on from the restored board:
+        
+        >>> (src, dst) = (g.board.occupied_cells()[-1], g.board.free_cells()[0])
+        >>> g.make_move(src.row, src.col, dst.row, dst.col)
+        >>> g.record_trace()
+        >>> g.trace[-1][0] == [c.piece for c in g.board.all_cells()]
+        True
+        """
+        return (bytes(self.board.pieces),
+                self.rng.getstate(),
+                self.score,
+                self.drop_delay,
+                list(self.next_pieces_queue),
+                self.last_move,
+                len(self.moves))
+
+
+    def restore(self, state):
+        """Go back to a state returned by snapshot"""
+        (pieces, rng_state, self.score, self.drop_delay, queue,
+         self.last_move, n_moves) = state
+        #the restored cells are changes for the next step of the trace
+        current = self.board.pieces
+        self._trace_changes.update(i for i in range(len(pieces))
+                                   if current[i] != pieces[i])
+        self.board.load(pieces)
+        self.rng.setstate(rng_state)
+        #the queue is the list of the pieces generator
+        self.next_pieces_queue = self.next_pieces_generator.pieces
+        self.next_pieces_queue[:] = queue
+        del self.moves[n_moves:]
+        self.last_changes = set()
+
+
+    def position_hash(self, with_queue = True):
+        """Return a 64 bits hash of the position: the board and, if
+        with_queue is True, the next pieces.
+        
+        >>> g = Game(seed = 2)
+        >>> g.position_hash(False) == g.board.hash
+        True
+        >>> g.position_hash() == g.clone().position_hash()
+        True
+        """
+        h = self.board.hash
+        if with_queue:
+            n = len(self.next_pieces_queue)
+            for (p, piece) in enumerate(self.next_pieces_queue):
+                #keys of queue pieces are distinct from board keys
+                h ^= zobrist_keys(n, 256 + piece)[p]
+        return h
+
+
+    def clone(self):
+        """Return a copy of the game, for lookahead. The board is copied as
+        a buffer, the copy has no trace and no instrumentation.
+        
+        >>> g = Game(seed = 9)
+        >>> c = g.clone()
+        >>> (src, dst) = (c.board.occupied_cells()[0], c.board.free_cells()[-1])
+        >>> c.make_move(src.row, src.col, dst.row, dst.col)
+        >>> g.make_move(src.row, src.col, dst.row, dst.col)
+        >>> (c.board.pieces, c.score, c.next_pieces_queue) == (g.board.pieces, g.score, g.next_pieces_queue)
+        True
+        >>> c.trace is None
+        True
+        """
+        result = copy.copy(self)
+        result.rng = Random()
+        result.rng.setstate(self.rng.getstate())
+        result.next_pieces_generator = copy.copy(self.next_pieces_generator)
+        result.next_pieces_generator.rng = result.rng
+        result.next_pieces_generator.pieces = list(self.next_pieces_queue)
+        result.next_pieces_queue = result.next_pieces_generator.pieces
+        result.board = self.board.copy()
+        result.last_changes = set()
+        result.stats = None
+        result._undo = []
+        result.trace = None
+        result._trace_changes = set()
+        result.moves = list(self.moves)
+        return result
+
+
+    def apply(self, move):
+        """Make move (start_row, start_col, end_row, end_col) so that it
+        can be reverted by undo. Moves made by apply are not recorded in
+        the trace. Return True if the move was possible.
+        
+        >>> g = Game(seed = 9)
+        >>> before = (bytes(g.board.pieces), g.score, list(g.next_pieces_queue), g.drop_delay)
+        >>> (src, dst) = (g.board.occupied_cells()[0], g.board.free_cells()[-1])
+        >>> g.apply((src.row, src.col, dst.row, dst.col))
+        True
+        >>> g.apply((dst.row, dst.col, src.row, src.col))
+        True
+        >>> g.undo()
+        >>> g.undo()
+        >>> (bytes(g.board.pieces), g.score, list(g.next_pieces_queue), g.drop_delay) == before
+        True
+        >>> len(g.trace)
+        1
+        >>> h = Game(seed = 9)
+        >>> g.rng.random() == h.rng.random()
+        True
+        """
+        n_moves = len(self.moves)
+        self._undo.append(([], (self.rng.getstate(),
+                                self.score,
+                                self.drop_delay,
+                                list(self.next_pieces_queue),
+                                self.last_move,
+                                n_moves)))
+        trace = self.trace
+        self.trace = None
+        try:
+            self.make_move(*move)
+        finally:
+            self.trace = trace
+        return len(self.moves) > n_moves
+
+
+    def undo(self):
+        """Revert the last move made by apply. The reverted cells are then
+        in last_changes."""
+        (cells, (rng_state, self.score, self.drop_delay, queue,
+                 self.last_move, n_moves)) = self._undo.pop()
+        self.last_changes = set()
+        for (row, col, piece) in reversed(cells):
+            self.board.set_piece(row, col, None)
+            if piece is not None:
+                self.board.set_piece(row, col, piece)
+            self.last_changes.add((row, col))
+        self.rng.setstate(rng_state)
+        self.next_pieces_queue = self.next_pieces_generator.pieces
+        self.next_pieces_queue[:] = queue
+        del self.moves[n_moves:]
+
+
+    @property
+    def n_filled_cells(self):
+        return self.board.n_occupied()
+
+
+    def random_free_cell(self):
+        if self.legacy_sampling:
+            return self.board.ordered_random_free_cell(self.rng)
+        return self.board.random_free_cell(self.rng)
+
+
     def generate_next_pieces(self):
         self.next_pieces_queue = self.next_pieces_generator.yield_next_pieces ()
         #TODO: use probablity law
@@ -141,9 +367,8 @@ class Game:
         """Put n random pieces on the board"""
         for i in range(n):
             p = self.next_pieces_generator.yield_next_piece()
-            c = self.rng.choice(self.board.free_cells())
-            self.board.set_piece (c.row, c.col, p)
-            self.n_filled_cells += 1
+            c = self.random_free_cell()
+            self.set_piece (c.row, c.col, p)
 
 
     def fill_board (self):
@@ -157,42 +382,56 @@ class Game:
         for piece in self.next_pieces_queue:
             if self.check_game_over ():
                 return
-            c = self.rng.choice(self.board.free_cells())
-            self.board.set_piece (c.row, c.col, piece)
+            c = self.random_free_cell()
+            self.set_piece (c.row, c.col, piece)
 
             inactivate = self.board.get_cell (c.row, c.col).get_all_directions (self.board.grid, Game.N_MATCH)
             if len(inactivate) > 0:
-                self.n_filled_cells -= len(inactivate)
                 for cell in inactivate:
-                    self.board.set_piece (cell.row, cell.col, None)
+                    self.set_piece (cell.row, cell.col, None)
                 self.update_score (len(inactivate))
-            self.n_filled_cells += 1
             
         #generate new pieces to replace the ones we just put on the board
         self.generate_next_pieces ()
 
 
+    def set_piece (self, row, col, piece):
+        """Change the board, and remember the changed cell"""
+        if self._undo:
+            self._undo[-1][0].append((row, col, self.board.get_piece(row, col)))
+        self.board.set_piece (row, col, piece)
+        self.last_changes.add((row, col))
+        self._trace_changes.add(self.board.index(row, col))
+
+
     def update_score (self, n_matched):
         self.score += (int) (45 * math.log (0.25 * n_matched))
 
 
     def check_game_over (self):
-        if self.n_cells - self.n_filled_cells == 0:
+        if self.board.n_free() == 0:
             return True
         return False
 
 
     def next_step (self, just_scored = False):
+        stats = self.stats
+        if stats is not None:
+            t = perf_counter()
         self.record_trace()
+        if stats is not None:
+            t = stats.lap('record_trace', t)
         if just_scored:
             if self.mode == Mode.NORMAL:
                 return
             elif self.mode == Mode.DISTANCE:
                 self.drop_delay +=2
         self.fill_board ()
+        if stats is not None:
+            stats.lap('fill_board', t)
 
 
-    def make_move (self, start_row, start_col, end_row, end_col):
+    def make_move (self, start_row, start_col, end_row, end_col, continued = False):
         """Make a move on the board.
         
         return True if the move could be completed, False otherwise
@@ -203,11 +442,28 @@ class Game:
         In distance mode, this method returns either if the move is finished, 
         or if a new piece is added on the board.
         
+        The cells changed by the move are then available in last_changes.
+        
+        >>> g = Game(seed = 12)
+        >>> (src, dst) = (g.board.occupied_cells()[0], g.board.free_cells()[0])
+        >>> (src_pos, dst_pos) = ((src.row, src.col), (dst.row, dst.col))
+        >>> g.make_move(src.row, src.col, dst.row, dst.col)
+        >>> src_pos in g.last_changes and dst_pos in g.last_changes
+        True
         """
+        if not continued:
+            self.last_changes = set()
+        stats = self.stats
+        if stats is not None:
+            if not continued:
+                stats.begin_move((start_row, start_col, end_row, end_col))
+            t = perf_counter()
         path = self.board.find_path (start_row,
                                      start_col,
                                      end_row,
                                      end_col)
+        if stats is not None:
+            t = stats.lap('pathfinding', t)
 
         if path is None or len(path) == 0:
             #move is impossible, don't do it
@@ -215,6 +471,8 @@ class Game:
         
         #record move
         self.last_move = (start_row, start_col, end_row, end_col)
+        if not continued:
+            self.moves.append(self.last_move)
         
         #evaluate which event (get to destination vs drop) will happen first
         if self.mode == Mode.DISTANCE and len(path) > self.drop_delay:
@@ -234,42 +492,309 @@ class Game:
         
         #move to (row, col)
         p = self.board.get_piece(start_row, start_col)
-        self.board.set_piece (start_row, start_col, None)
-        self.board.set_piece (row, col, p)
+        self.set_piece (start_row, start_col, None)
+        self.set_piece (row, col, p)
+        if stats is not None:
+            t = stats.lap('move', t)
         
         #execute board logic at (row, col)
         inactivate = self.board.get_cell (row, col).get_all_directions (self.board.grid, Game.N_MATCH)
         if len(inactivate) > 0:
-            self.n_filled_cells -= len(inactivate)
             for cell in inactivate:
-                self.board.set_piece (cell.row, cell.col, None)
+                self.set_piece (cell.row, cell.col, None)
             self.update_score (len(inactivate))
+        if stats is not None:
+            stats.lap('match', t)
         
         #proceed to fill board
         self.next_step(len(inactivate) > 0)
         
         #if not finished, evaluate new path
         if not finished: #todo check piece still exists
-            new_path = self.board.find_path (row,
-                                     col,
-                                     end_row,
-                                     end_col)
-            if len(new_path) + n_moves <= len(path):
-                self.make_move(row, col, end_row, end_col)
+            dist = self.board.distance_map (row, col)
+            new_length = dist[self.board.index (end_row, end_col)]
+            if new_length > 0 and new_length + n_moves <= len(path):
+                self.make_move(row, col, end_row, end_col, continued = True)
 
 
     def record_trace(self):
-        """Add current state (board, next_pieces, move, score) to the trace"""
+        """Add current state (board, next_pieces, move, score) to the trace
         
-        board_data = [c.piece for c in self.board.all_cells()]
-        self.trace.append((board_data, self.next_pieces_queue, self.last_move, self.score))
+        >>> g = Game(seed = 4)
+        >>> g.trace[0][0] == [c.piece for c in g.board.all_cells()]
+        True
+        >>> g.trace[0][1] == g.next_pieces_queue
+        True
+        """
+        if self.trace is None:
+            #trace disabled
+            return
+        pieces = self.board.pieces
+        changes = [(i, pieces[i]) for i in sorted(self._trace_changes)]
+        self._trace_changes = set()
+        self.trace.append(changes, self.next_pieces_queue, self.last_move, self.score)
     
         
+@lru_cache(maxsize = None)
+def eval_windows(n_rows, n_cols):
+    """Evaluation windows of every cell of a n_rows x n_cols board: for
+    each index, the windows of the 5 cells lines (horizontal, vertical,
+    diagonals) through that cell, as the indices of their 4 other cells.
+    Shared by all the helpers of that shape.
+    
+    >>> w = eval_windows(7, 7)
+    >>> w[0]
+    ((1, 2, 3, 4), (7, 14, 21, 28), (8, 16, 24, 32))
+    >>> len(w[24])
+    12
+    >>> w is eval_windows(7, 7)
+    True
+    """
+    result = []
+    for r in range(n_rows):
+        for c in range(n_cols):
+            windows = []
+            for D in range(-2,3):
+                #horizontal
+                if c + D - 2>= 0 and c + D + 2 < n_cols:
+                    windows.append(tuple(r * n_cols + c + d
+                                         for d in range(D-2, D+3)
+                                         if d != 0))
+                #vertical
+                if r + D - 2>= 0 and r + D + 2 < n_rows:
+                    windows.append(tuple((r + d) * n_cols + c
+                                         for d in range(D-2, D+3)
+                                         if d != 0))
+                #diagonal 1
+                if c + D - 2>= 0 \
+                   and r + D - 2>= 0 \
+                   and r + D + 2 < n_rows \
+                   and c + D + 2 < n_cols:
+                    windows.append(tuple((r + d) * n_cols + c + d
+                                         for d in range(D-2,D+3)
+                                         if d != 0))
+                #diagonal 2
+                if c + D - 2 >= 0 \
+                   and r - D - 2 >= 0 \
+                   and c + D + 2 < n_cols \
+                   and r - D + 2 < n_rows:
+                    windows.append(tuple((r - d) * n_cols + c + d
+                                         for d in range(D-2,D+3)
+                                         if d != 0))
+            result.append(tuple(windows))
+    return tuple(result)
+
+
+@lru_cache(maxsize = None)
+def eval_dependents(n_rows, n_cols):
+    """For each index, the indices whose evaluation windows contain it"""
+    result = [set() for i in range(n_rows * n_cols)]
+    for (i, windows) in enumerate(eval_windows(n_rows, n_cols)):
+        for w in windows:
+            for k in w:
+                result[k].add(i)
+    return tuple(tuple(sorted(d)) for d in result)
+
+
+def _window_score(same, free):
+    """Evaluation of a window with same pieces of the type, and free cells"""
+    diff = 4 - same - free
+    if same > diff:
+        return math.pow(same - diff + 1, 2)*10 + free
+    return 0
+
+
+@lru_cache(maxsize = None)
+def pattern_scores(n_types):
+    """Return the evaluation of each window pattern, for n_types types.
+    
+    A window is coded in base n_types + 2: digit j is the buffer value of
+    its j-th cell, where the values above n_types (unknown types) are
+    replaced by n_types + 1. At most one type can score in a window: the
+    entry of a code is None, or the (type, score) of this type. As in
+    _eval_cell, piece 0 counts as free.
+    
+    >>> scores = pattern_scores(5)
+    >>> len(scores)
+    2401
+    >>> scores[3 + 3 * 7 + 3 * 49]
+    (2, 161.0)
+    >>> scores[3 + 4 * 7] is None
+    True
+    """
+    base = n_types + 2
+    result = []
+    for code in range(base ** 4):
+        digits = [(code // base ** j) % base for j in range(4)]
+        free = sum(1 for d in digits if d <= 1)
+        entry = None
+        for d in set(digits):
+            if 1 < d <= n_types:
+                score = _window_score(digits.count(d), free)
+                if score:
+                    entry = (d - 1, score)
+        result.append(entry)
+    return tuple(result)
+
+
+@lru_cache(maxsize = None)
+def _pattern_slots(n_rows, n_cols):
+    """Return the evaluation windows of a n_rows x n_cols board, for the
+    pattern engine: (for each index, the numbers of its windows, the
+    distinct windows, for each index the (window, position) of the windows
+    that contain it)
+    """
+    numbers = dict()
+    cell_windows = []
+    for w in eval_windows(n_rows, n_cols):
+        cell_windows.append(tuple(numbers.setdefault(cells, len(numbers))
+                                  for cells in w))
+    windows = tuple(numbers)
+    slots = [[] for i in range(n_rows * n_cols)]
+    for (w, cells) in enumerate(windows):
+        for (j, k) in enumerate(cells):
+            slots[k].append((w, j))
+    return (tuple(cell_windows), windows, tuple(tuple(s) for s in slots))
+
+
+@lru_cache(maxsize = None)
+def _window_index(n_rows, n_cols):
+    """Return the evaluation windows as a (read-only) index array of shape
+    (n_cells, n_windows, 4) into the board buffer, padded with windows
+    of index n_cells, and the matching validity mask.
+    """
+    windows = eval_windows(n_rows, n_cols)
+    n_cells = n_rows * n_cols
+    n_windows = max(len(w) for w in windows)
+    index = np.full((n_cells, n_windows, 4), n_cells, dtype=np.intp)
+    valid = np.zeros((n_cells, n_windows), dtype=bool)
+    for (i, w) in enumerate(windows):
+        index[i, :len(w)] = w
+        valid[i, :len(w)] = True
+    index.flags.writeable = False
+    valid.flags.writeable = False
+    return (index, valid)
+
+
+class Actions(Mapping):
+    """Possible moves, by free region. regions is the list of (cells,
+    border) of each free region: its cells, and the pieces next to it,
+    which can move to any of its cells. Both are in board order.
+    
+    Actions is also a read-only dictionary, from each destination cell to
+    the list of its source cells. This view is only built when used.
+    
+    If the board is given, the moves are also available as arrays (see
+    arrays).
+    
+    >>> b = Board(2, 3)
+    >>> b.set_piece(0, 1, 2)
+    >>> b.set_piece(1, 1, 4)
+    >>> cells = b.cells()
+    >>> act = Actions([([cells[0], cells[3]], [cells[1], cells[4]]),
+    ...                ([cells[2], cells[5]], [cells[1], cells[4]])])
+    >>> len(act)
+    4
+    >>> list(act.moves())[:2]
+    [(Cell(0, 1), Cell(0, 0)), (Cell(1, 1), Cell(0, 0))]
+    >>> act[cells[5]]
+    [Cell(0, 1), Cell(1, 1)]
+    >>> cells[1] in act
+    False
+    """
+
+    def __init__(self, regions, board = None):
+        self.regions = regions
+        self.board = board
+        self._dict = None
+        self._arrays = None
+
+
+    def moves(self):
+        """Yield every move (src, dst): by region, destination, then
+        source"""
+        for (cells, border) in self.regions:
+            for dst in cells:
+                for src in border:
+                    yield (src, dst)
+
+
+    def arrays(self):
+        """Return the moves as parallel numpy arrays (index of the source,
+        index of the destination, type of the piece), in the order of
+        moves()
+        
+        >>> b = Board(2, 3)
+        >>> b.set_piece(0, 1, 2)
+        >>> b.set_piece(1, 1, 4)
+        >>> cells = b.cells()
+        >>> act = Actions([([cells[0], cells[3]], [cells[1], cells[4]])], b)
+        >>> [a.tolist() for a in act.arrays()]
+        [[1, 4, 1, 4], [0, 0, 3, 3], [2, 4, 2, 4]]
+        """
+        if self._arrays is None:
+            n_cols = self.board.n_cols
+            (src, dst) = ([], [])
+            for (cells, border) in self.regions:
+                if not border:
+                    continue
+                d = np.array([c.row * n_cols + c.col for c in cells], dtype=np.intp)
+                s = np.array([c.row * n_cols + c.col for c in border], dtype=np.intp)
+                dst.append(np.repeat(d, len(s)))
+                src.append(np.tile(s, len(d)))
+            if src:
+                (src, dst) = (np.concatenate(src), np.concatenate(dst))
+            else:
+                (src, dst) = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+            pieces = np.frombuffer(self.board.pieces, dtype=np.uint8)
+            types = pieces[src].astype(np.intp) - 1
+            self._arrays = (src, dst, types)
+        return self._arrays
+
+
+    def _get_dict(self):
+        if self._dict is None:
+            self._dict = {dst: border
+                          for (cells, border) in self.regions
+                          for dst in cells}
+        return self._dict
+
+
+    def __getitem__(self, cell):
+        return self._get_dict()[cell]
+
+
+    def __iter__(self):
+        return iter(self._get_dict())
+
+
+    def __len__(self):
+        return sum(len(cells) for (cells, border) in self.regions)
+
+
+    def __repr__(self):
+        return repr(self._get_dict())
+
+
 class Helper:
 
-    def __init__(self, game):
+    #evaluation engines: pure python loop, numpy arrays, or lookup of
+    #window patterns (kept up to date by update_eval_cache)
+    PYTHON = "python"
+    NUMPY = "numpy"
+    PATTERN = "pattern"
+
+    def __init__(self, game, engine = None, table = None):
         """Create an helper for game.
         
+        engine selects how build_eval_cache is computed (Helper.PYTHON,
+        Helper.NUMPY or Helper.PATTERN); by default numpy is used if it is
+        available.
+        
+        If a transposition table (see transposition) is given, the results
+        of actions and build_eval_cache are stored in it, and reused when
+        the same board is seen again.
+        
         >>> g = Game()
         >>> hp = Helper(g)
         >>> hp.board is g.board
@@ -297,50 +822,47 @@ class Helper:
         3
         
         """
+        self.game = game
         self.board = game.board
         self.n_types = game.n_types
         self.cache = None
-        result = list()
-        #prepare evalutation neighbourhood
-        for r in range(game.n_rows):
-            result.append(list())
-            for c in range(game.n_cols):
-                result[r].append(list())
-                for D in range(-2,3):
-                    #horizontal
-                    if c + D - 2>= 0 and c + D + 2 < game.n_cols:
-                        result[r][c].append([self.board.get_cell(r, c+d) 
-                                             for d in range(D-2, D+3)
-                                             if d != 0])
-                    #vertical
-                    if r + D - 2>= 0 and r + D + 2 < game.n_rows:
-                        result[r][c].append([self.board.get_cell(r+d, c) 
-                                             for d in range(D-2, D+3)
-                                             if d != 0])
-                    #diagonal 1
-                    if c + D - 2>= 0 \
-                       and r + D - 2>= 0 \
-                       and r + D + 2 < game.n_rows \
-                       and c + D + 2 < game.n_cols:
-                        result[r][c].append([self.board.get_cell(r+d,c+d) 
-                                             for d in range(D-2,D+3)
-                                             if d != 0])
-                    #diagonal 2
-                    if c + D - 2 >= 0 \
-                       and r - D - 2 >= 0 \
-                       and c + D + 2 < game.n_cols \
-                       and r - D + 2 < game.n_rows:
-                        result[r][c].append([self.board.get_cell(r-d,c+d)
-                                             for d in range(D-2,D+3)
-                                             if d != 0])
-                    
-        self.neighbourhood = result
+        #the eval cache as a (n_cells, n_types) array, see eval_array
+        self.values = None
+        if engine is None:
+            engine = Helper.PYTHON if np is None else Helper.NUMPY
+        if engine == Helper.NUMPY and np is None:
+            raise ValueError("numpy is not available")
+        if engine not in (Helper.PYTHON, Helper.NUMPY, Helper.PATTERN):
+            raise ValueError("unknown evaluation engine %s" % engine)
+        self.engine = engine
+        #pattern engine: code of each window for each type, and the board
+        #buffer they were computed from
+        self._codes = None
+        self._pattern_pieces = None
+        self.table = table
+        #evaluation windows, shared by all the helpers of this shape
+        self.windows = eval_windows(game.n_rows, game.n_cols)
+        self._neighbourhood = None
+
+
+    @property
+    def neighbourhood(self):
+        """Evaluation windows of each cell, as lists of Cells: 
+        neighbourhood[row][col] is the list of the windows of (row, col)"""
+        if self._neighbourhood is None:
+            b = self.board
+            cells = b.cells()
+            self._neighbourhood = [[[[cells[k] for k in w]
+                                     for w in self.windows[b.index(r, c)]]
+                                    for c in range(b.n_cols)]
+                                   for r in range(b.n_rows)]
+        return self._neighbourhood
 
 
     def actions(self):
-        """return all possible actions, in the form of a dictionary,
-        with each possible destination cell a key, associated with all the 
-        possible source cells
+        """return all possible actions, by free region (see Actions). This
+        is also a dictionary, with each possible destination cell a key,
+        associated with all the possible source cells
         
         >>> g = MockGame(3,5)
         >>> g.board.set_piece(0, 2, 1)
@@ -349,6 +871,8 @@ class Helper:
         >>> act = hp.actions()
         >>> len(act)
         13
+        >>> [(len(cells), border) for (cells, border) in act.regions]
+        [(13, [Cell(0, 2), Cell(1, 2)])]
         >>> [c.piece is None for c in act.keys()]
         [True, True, True, True, True, True, True, True, True, True, True, True, True]
         >>> [len(act[c]) for c in g.board.free_cells()]
@@ -383,40 +907,50 @@ class Helper:
         
         
         """
-        result = dict()
-        
         b = self.board
-        free = b.free_cells();
-        while len(free) > 0:
-            c = free.pop()
-            #try to grow free cell
-            zone = set()
-            zone.add(c)
-            border = set()
-            to_inspect = c.get_neighbours(b.grid)
-            while len(to_inspect) > 0:
-                c = to_inspect.pop()
-                if c.piece is None:
-                    #n is free, try to grow
-                    if c in free:
-                        free.remove(c)
-                    zone.add(c)
-                    for n in c.get_neighbours(b.grid):
-                        if n not in zone:
-                            #neighbour not alrady seen, inspect
-                            to_inspect.append(n)
-                else:
-                    #n is part of border
-                    border.add(c)
-            #zone is finished
-            for c in zone:
-                if c in result.keys():
-                    l = list(result[c])
-                    l.extend(list(border))
-                    result[c] = l
+        regions = None
+        if self.table is not None:
+            key = ('actions', b.hash)
+            regions = self.table.get(key)
+        if regions is None:
+            regions = self._find_regions()
+            if self.table is not None:
+                self.table.store(key, regions)
+        cells = b.cells()
+        return Actions([([cells[i] for i in region], [cells[i] for i in border])
+                        for (region, border) in regions],
+                       b)
+
+
+    def _find_regions(self):
+        """Return the list of (indices of the cells, indices of the
+        bordering pieces) of each free region, in board order. The regions
+        are the ones kept up to date by the board."""
+        b = self.board
+        label = b._get_labels()
+        adjacent = b._get_adjacent()
+        regions = dict()
+        borders = dict()
+        steps = 0
+        for (i, r) in enumerate(label):
+            if r >= 0:
+                if r in regions:
+                    regions[r].append(i)
                 else:
-                    result[c] = list(border)
-        return result
+                    regions[r] = [i]
+                continue
+            for k in adjacent[i]:
+                steps += 1
+                r = label[k]
+                if r >= 0:
+                    border = borders.setdefault(r, [])
+                    #pieces are seen in order: only the last one can be i
+                    if not border or border[-1] != i:
+                        border.append(i)
+        if b.stats is not None:
+            b.stats.count('flood_steps', steps)
+        return [(tuple(cells), tuple(borders.get(r, ())))
+                for (r, cells) in regions.items()]
 
 
     def build_eval_cache(self):
@@ -440,28 +974,295 @@ class Helper:
         >>> hp.cache[3][3]
         {0: 44.0, 1: 147.0, 2: 44.0, 3: 44.0, 4: 44.0}
         """
-        result = []
-        for r in range(self.board.n_rows):
-            result.append(list())
-            for c in range(self.board.n_cols):
-                result[r].append(list())
-                result[r][c] = dict()
-                for t in range(self.n_types):
-                    v = 0
-                    for mask in self.neighbourhood[r][c]:
-                        same = 0
-                        free = 0
-                        for cell in mask:
-                            if cell.piece:
-                                if cell.piece == t:
-                                    same += 1
-                            else:
-                                free += 1
-                        diff = 4 - same - free
-                        if same > diff:
-                            v = max(v, math.pow(same - diff + 1, 2)*10 + free)
-                    result[r][c][t] = v
-        self.cache = result
+        if self.table is not None:
+            key = ('eval', self.n_types, self.board.hash)
+            entry = self.table.get(key)
+            if entry is not None:
+                #rows are copied, as update_eval_cache changes them
+                self.cache = [list(row) for row in entry]
+                self.values = None
+                #window patterns are computed again when needed
+                self._codes = None
+                return
+        if self.board.stats is not None:
+            self.board.stats.count('eval_cache_builds')
+        self.values = None
+        if self.engine == Helper.NUMPY:
+            self._build_eval_cache_numpy()
+        elif self.engine == Helper.PATTERN:
+            self._build_patterns()
+            self.cache = [[self._eval_cell_pattern(r, c) for c in range(self.board.n_cols)]
+                          for r in range(self.board.n_rows)]
+        else:
+            self.cache = [[self._eval_cell(r, c) for c in range(self.board.n_cols)]
+                          for r in range(self.board.n_rows)]
+        if self.table is not None:
+            self.table.store(key, [list(row) for row in self.cache])
+
+
+    def _build_eval_cache_numpy(self):
+        """Vectorized build_eval_cache: all cells, windows and types are
+        evaluated at once.
+        
+        >>> g = MockGame(9, 9)
+        >>> for (r, c, p) in [(0, 0, 1), (1, 1, 1), (2, 2, 0), (4, 4, 2),
+        ...                   (4, 5, 2), (4, 7, 2), (3, 0, 3), (8, 8, 4)]:
+        ...     g.board.set_piece(r, c, p)
+        >>> hp = Helper(g, Helper.PYTHON)
+        >>> hp.build_eval_cache()
+        >>> hp_np = Helper(g, Helper.NUMPY)
+        >>> hp_np.build_eval_cache()
+        >>> hp_np.cache == hp.cache
+        True
+        >>> hp_np.cache[0][4]
+        {0: 0, 1: 43.0, 2: 43.0, 3: 0, 4: 0}
+        """
+        b = self.board
+        (index, valid) = _window_index(b.n_rows, b.n_cols)
+        #board values, with a free sentinel for padding windows. As in
+        #_eval_cell, piece 0 is not counted as a piece.
+        v = np.zeros(b.n_cells + 1, dtype=np.int8)
+        v[:-1] = np.frombuffer(b.pieces, dtype=np.uint8)
+        windows = v[index]
+        occupied = windows > 1
+        free = 4 - occupied.sum(axis=2)
+        types = np.arange(1, self.n_types + 1, dtype=np.int8)[:, None, None, None]
+        same = ((windows == types) & occupied).sum(axis=3)
+        diff = 4 - same - free
+        score = np.where((same > diff) & valid,
+                         (same - diff + 1) ** 2 * 10.0 + free,
+                         0.0)
+        self.values = score.max(axis=2).T
+        values = self.values.reshape(b.n_rows, b.n_cols, self.n_types)
+        #same cache content as the python engine (0 when no alignment)
+        self.cache = [[{t: v or 0 for (t, v) in enumerate(cell)} for cell in row]
+                      for row in values.tolist()]
+
+
+    def update_eval_cache(self, changes):
+        """Update the evaluation cache after the cells in changes (a
+        collection of (row, col)) have been modified. Only the cells
+        whose neighbourhood contains a changed cell are evaluated again.
+        
+        >>> g = MockGame()
+        >>> hp = Helper(g)
+        >>> hp.build_eval_cache()
+        >>> for (r, c, p) in [(0, 0, 1), (1, 1, 1), (4, 4, 2), (3, 0, 3)]:
+        ...     g.board.set_piece(r, c, p)
+        >>> hp.update_eval_cache([(0, 0), (1, 1), (4, 4), (3, 0)])
+        >>> cache = hp.cache
+        >>> hp.build_eval_cache()
+        >>> cache == hp.cache
+        True
+        """
+        if self.cache is None:
+            self.build_eval_cache()
+            return
+        n_cols = self.board.n_cols
+        dependents = eval_dependents(self.board.n_rows, n_cols)
+        affected = set()
+        for (r, c) in changes:
+            affected.update(dependents[r * n_cols + c])
+        if self.engine == Helper.PATTERN:
+            self._update_patterns(changes)
+            evaluate = self._eval_cell_pattern
+        else:
+            evaluate = self._eval_cell
+        for i in affected:
+            (r, c) = divmod(i, n_cols)
+            self.cache[r][c] = evaluate(r, c)
+            if self.values is not None:
+                self.values[i] = list(self.cache[r][c].values())
+        if self.board.stats is not None:
+            self.board.stats.count('eval_cache_updates')
+            self.board.stats.count('eval_cells', len(affected))
+
+
+    def _eval_cell(self, r, c):
+        """Evaluate each type of piece at (r, c)"""
+        pieces = self.board.pieces
+        result = [0] * self.n_types
+        for w in self.windows[r * self.board.n_cols + c]:
+            #count free cells and pieces of each type. Piece 0 counts as
+            #free (buffer value 1)
+            free = 0
+            counts = dict()
+            for k in w:
+                v = pieces[k]
+                if v > 1:
+                    counts[v] = counts.get(v, 0) + 1
+                else:
+                    free += 1
+            for (v, same) in counts.items():
+                diff = 4 - same - free
+                t = v - 1
+                if same > diff and t < self.n_types:
+                    result[t] = max(result[t], math.pow(same - diff + 1, 2)*10 + free)
+        return dict(enumerate(result))
+
+
+    def _build_patterns(self):
+        """Compute the code of every window (see pattern_scores)"""
+        b = self.board
+        windows = _pattern_slots(b.n_rows, b.n_cols)[1]
+        top = self.n_types + 1
+        s = [min(v, top) for v in b.pieces]
+        base = top + 1
+        (b2, b3) = (base ** 2, base ** 3)
+        self._codes = [s[k0] + base * s[k1] + b2 * s[k2] + b3 * s[k3]
+                       for (k0, k1, k2, k3) in windows]
+        self._pattern_pieces = s
+
+
+    def _update_patterns(self, changes):
+        """Update the codes of the windows that contain the cells in
+        changes"""
+        if self._codes is None:
+            self._build_patterns()
+            return
+        b = self.board
+        pieces = b.pieces
+        old = self._pattern_pieces
+        slots = _pattern_slots(b.n_rows, b.n_cols)[2]
+        top = self.n_types + 1
+        weights = tuple((top + 1) ** j for j in range(4))
+        codes = self._codes
+        for (r, c) in changes:
+            k = r * b.n_cols + c
+            after = min(pieces[k], top)
+            d = after - old[k]
+            if d:
+                old[k] = after
+                for (w, j) in slots[k]:
+                    codes[w] += d * weights[j]
+
+
+    def _eval_cell_pattern(self, r, c):
+        """Evaluate each type of piece at (r, c), from the window codes
+        
+        >>> g = MockGame()
+        >>> hp = Helper(g, Helper.PATTERN)
+        >>> hp.build_eval_cache()
+        >>> ref = Helper(g, Helper.PYTHON)
+        >>> for (r, c, p) in [(0, 0, 1), (1, 1, 1), (2, 2, 1), (4, 4, 2), (3, 0, 0)]:
+        ...     g.board.set_piece(r, c, p)
+        >>> hp.update_eval_cache([(0, 0), (1, 1), (2, 2), (4, 4), (3, 0)])
+        >>> ref.build_eval_cache()
+        >>> hp.cache == ref.cache
+        True
+        >>> hp.cache[3][3]
+        {0: 0, 1: 90.0, 2: 0, 3: 0, 4: 0}
+        """
+        cell_windows = _pattern_slots(self.board.n_rows, self.board.n_cols)[0]
+        scores = pattern_scores(self.n_types)
+        codes = self._codes
+        result = [0] * self.n_types
+        for w in cell_windows[r * self.board.n_cols + c]:
+            entry = scores[codes[w]]
+            if entry is not None and entry[1] > result[entry[0]]:
+                result[entry[0]] = entry[1]
+        return dict(enumerate(result))
+
+
+    def eval_array(self):
+        """Return the eval cache as an array of shape (n_cells, n_types),
+        or None if numpy is not available. The array is kept up to date by
+        update_eval_cache.
+        
+        >>> g = MockGame()
+        >>> hp = Helper(g)
+        >>> g.board.set_piece(0, 0, 1)
+        >>> hp.eval_array()[1].tolist() == list(hp.cache[0][1].values())
+        True
+        >>> g.board.set_piece(0, 2, 1)
+        >>> hp.update_eval_cache([(0, 2)])
+        >>> hp.eval_array()[1].tolist() == list(hp.cache[0][1].values())
+        True
+        """
+        if np is None:
+            return None
+        if self.cache is None:
+            self.build_eval_cache()
+        if self.values is None:
+            self.values = np.array([list(cell.values()) for row in self.cache for cell in row],
+                                   dtype=float)
+        return self.values
+
+
+    def candidate_moves(self, act = None):
+        """Yield the moves (bound, order, value, src, dst) of act (by
+        default, all the actions), by destination, in decreasing order of
+        bound. value is eval(dst) - eval(src) for the type of the piece
+        (as heuristic_2), bound is an upper bound of the values of the
+        moves to dst and of all the moves yielded after it, and order the
+        position of the move in act.moves(). A consumer can stop as soon
+        as bound is lower than the best value it has.
+        
+        The bound of a destination is its best eval for any type, minus
+        the lowest eval of a source of its region.
+        """
+        if act is None:
+            act = self.actions()
+        if self.cache is None:
+            self.build_eval_cache()
+        cache = self.cache
+        #piece types are read from the buffer once per source
+        pieces = self.board.pieces
+        n_cols = self.board.n_cols
+        heap = []
+        offset = 0
+        for (cells, border) in act.regions:
+            if border:
+                sources = []
+                for src in border:
+                    t = pieces[src.row * n_cols + src.col] - 1
+                    sources.append((src, t, cache[src.row][src.col][t]))
+                low = min(e for (src, t, e) in sources)
+                for (j, dst) in enumerate(cells):
+                    bound = max(cache[dst.row][dst.col].values()) - low
+                    heap.append((-bound, offset + j * len(border), dst, sources))
+            offset += len(cells) * len(border)
+        heapify(heap)
+        while heap:
+            (bound, order, dst, sources) = heappop(heap)
+            row = cache[dst.row][dst.col]
+            for (s, (src, t, e)) in enumerate(sources):
+                yield (-bound, order + s, row[t] - e, src, dst)
+
+
+    def top_k(self, k, act = None):
+        """Return the k best moves (value, src, dst) by decreasing value (see
+        candidate_moves), moves of same value in the order of act. Only
+        the candidates that may be better than the k-th best move are read,
+        and at most k moves are kept.
+        
+        >>> g = Game(seed = 4)
+        >>> hp = Helper(g)
+        >>> act = hp.actions()
+        >>> best = hp.top_k(5, act)
+        >>> moves = sorted([(hp.eval_move(src.piece, dst.row, dst.col)
+        ...                  - hp.eval_move(src.piece, src.row, src.col), src, dst)
+        ...                 for (src, dst) in act.moves()], key = lambda m: -m[0])
+        >>> best == moves[:5]
+        True
+        >>> read = sum(1 for m in hp.candidate_moves(act))
+        >>> read == len(moves)
+        True
+        """
+        if k <= 0:
+            return []
+        #min-heap of the best moves: the worst one (lowest value, then
+        #last in act) is first
+        best = []
+        for (bound, order, value, src, dst) in self.candidate_moves(act):
+            if len(best) < k:
+                heappush(best, (value, -order, src, dst))
+            elif bound < best[0][0]:
+                break
+            elif (value, -order) > best[0][:2]:
+                heapreplace(best, (value, -order, src, dst))
+        best.sort(key = lambda m: m[:2], reverse = True)
+        return [(value, src, dst) for (value, order, src, dst) in best]
 
 
     def eval_move(self, piece, to_row, to_col):
@@ -475,15 +1276,29 @@ class Helper:
 
     def reachable_cells(self, from_row, from_col):
         """Return the list of reachables cells
-        """
-        return [to for to in self.board.free_cells()
-                if self.reachable(from_row, from_col, to.row, to.col)]
         
+        >>> g = MockGame(3, 5)
+        >>> g.board.set_piece(0, 3, 1)
+        >>> g.board.set_piece(1, 3, 1)
+        >>> g.board.set_piece(2, 3, 1)
+        >>> hp = Helper(g)
+        >>> len(hp.reachable_cells(0, 0))
+        8
+        >>> hp.reachable_cells(0, 4)
+        [Cell(1, 4), Cell(2, 4)]
+        """
+        b = self.board
+        i = b.index(from_row, from_col)
+        reachable = set(b.region(from_row, from_col))
+        for k in b._get_adjacent()[i]:
+            reachable |= b.region(*divmod(k, b.n_cols))
+        reachable.discard(i)
+        cells = b.cells()
+        return [cells[k] for k in sorted(reachable)]
 
 
     def reachable(self, from_row, from_col, to_row, to_col):
-        path = self.board.find_path(from_row, from_col, to_row, to_col)
-        return (len(path) > 0)
+        return self.board.reachable(from_row, from_col, to_row, to_col)
 
 
 if __name__=='__main__':
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact trace of a game: the steps are stored as deltas in a binary,
+append-only record.
+"""
+
+import struct
+from array import array
+
+from board import Board
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+#header: n_rows, n_cols
+HEADER = struct.Struct('<BB')
+#step: has move, move (4 x row/col), score delta, number of changes,
+#number of next pieces
+STEP = struct.Struct('<B4BiHB')
+#change: index in the board buffer, new value (Board buffer encoding)
+CHANGE = struct.Struct('<HB')
+NO_MOVE = (0, 0, 0, 0)
+
+
+class Trace:
+    """Trace of a game. The first step is encoded from an empty board,
+    each other step only holds the move, the cells that changed, the next
+    pieces and the score change since the previous step.
+
+    Each step reads as the tuple (board, next_pieces, move, score) where
+    board is the list of the pieces of the board (None for a free cell).
+
+    >>> t = Trace(3, 4)
+    >>> t.append([(0, 2), (5, 1)], [1, 2], None, 0)
+    >>> t.append([(0, 0), (6, 3)], [0, 4], (0, 0, 1, 2), 10)
+    >>> len(t)
+    2
+    >>> t[0]
+    ([1, None, None, None, None, 0, None, None, None, None, None, None], [1, 2], None, 0)
+    >>> t[1]
+    ([None, None, None, None, None, 0, 2, None, None, None, None, None], [0, 4], (0, 0, 1, 2), 10)
+    >>> [s[3] for s in t]
+    [0, 10]
+    >>> list(t.moves())
+    [None, (0, 0, 1, 2)]
+    >>> u = Trace.from_bytes(t.to_bytes())
+    >>> list(u) == list(t)
+    True
+    """
+
+    def __init__(self, n_rows, n_cols):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.data = bytearray(HEADER.pack(n_rows, n_cols))
+        #offset of each step in data
+        self.offsets = array('L')
+        self._score = 0
+
+
+    def append(self, changes, next_pieces, move, score):
+        """Add a step. changes is a collection of (index, value), the
+        new values of the changed cells, in the Board buffer encoding."""
+        self.offsets.append(len(self.data))
+        changes = list(changes)
+        self.data += STEP.pack(move is not None,
+                               *(move or NO_MOVE),
+                               score - self._score,
+                               len(changes),
+                               len(next_pieces))
+        for c in changes:
+            self.data += CHANGE.pack(*c)
+        self.data += bytes(next_pieces)
+        self._score = score
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def _read(self, offset):
+        """Decode the step at offset, return (changes, next_pieces, move,
+        score delta, offset of the next step)"""
+        (has_move, r0, c0, r1, c1, delta, n_changes, n_next) = STEP.unpack_from(self.data, offset)
+        offset += STEP.size
+        changes = [CHANGE.unpack_from(self.data, offset + i * CHANGE.size)
+                   for i in range(n_changes)]
+        offset += n_changes * CHANGE.size
+        next_pieces = list(self.data[offset:offset + n_next])
+        move = (r0, c0, r1, c1) if has_move else None
+        return (changes, next_pieces, move, delta, offset + n_next)
+
+
+    def moves(self):
+        """Yield the move of each step, without rebuilding the boards"""
+        offset = HEADER.size
+        for k in range(len(self)):
+            (changes, next_pieces, move, delta, offset) = self._read(offset)
+            yield move
+
+
+    def steps(self, start = 0, stop = None):
+        """Yield the steps from start to stop (excluded). The board is
+        rebuilt incrementally from the first step."""
+        if stop is None or stop > len(self):
+            stop = len(self)
+        board = bytearray(self.n_rows * self.n_cols)
+        score = 0
+        offset = HEADER.size
+        for k in range(stop):
+            (changes, next_pieces, move, delta, offset) = self._read(offset)
+            for (i, v) in changes:
+                board[i] = v
+            score += delta
+            if k >= start:
+                yield ([None if v == Board.EMPTY else v - 1 for v in board],
+                       next_pieces, move, score)
+
+
+    def __iter__(self):
+        return self.steps()
+
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        if k < 0 or k >= len(self):
+            raise IndexError("trace step out of range")
+        return next(self.steps(k, k + 1))
+
+
+    def to_bytes(self):
+        return bytes(self.data)
+
+
+    @staticmethod
+    def from_bytes(data):
+        (n_rows, n_cols) = HEADER.unpack_from(data, 0)
+        t = Trace(n_rows, n_cols)
+        t.data = bytearray(data)
+        offset = HEADER.size
+        while offset < len(data):
+            t.offsets.append(offset)
+            (changes, next_pieces, move, delta, offset) = t._read(offset)
+            t._score += delta
+        return t
+
+
+def load(trace):
+    """Return a trace stored in the trace database: either a list of steps
+    (previous format) or the bytes of a Trace"""
+    if isinstance(trace, (bytes, bytearray)):
+        return Trace.from_bytes(trace)
+    return trace
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Counters and timers of the game engine hot paths.
+
+The engine only records something when a Stats object is attached to the
+game (see Game.enable_stats); otherwise the cost is one test per call.
+"""
+
+from time import perf_counter
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+class Stats:
+    """Counters (number of events) and timers (seconds) of a game, in
+    total and for each move.
+
+    >>> s = Stats()
+    >>> s.count('a')
+    >>> s.begin_move((0, 0, 1, 1))
+    >>> s.count('a', 3)
+    >>> t = s.lap('phase', perf_counter())
+    >>> s.counters['a']
+    4
+    >>> m = s.export()['moves']
+    >>> len(m)
+    1
+    >>> (m[0]['move'], m[0]['counters'])
+    ((0, 0, 1, 1), {'a': 3})
+    >>> 'phase' in m[0]['timers']
+    True
+    >>> s.reset()
+    >>> s.export()
+    {'counters': {}, 'timers': {}, 'moves': []}
+    """
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.counters = dict()
+        self.timers = dict()
+        self.moves = []
+        self._current = None
+
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def lap(self, name, start):
+        """Add the time elapsed since start to timer name, and return
+        the current time (the start of the next phase)"""
+        now = perf_counter()
+        self.timers[name] = self.timers.get(name, 0.0) + now - start
+        return now
+
+
+    def begin_move(self, move):
+        """Start recording a new move (this ends the previous one)"""
+        self._end_move()
+        self._current = (move, dict(self.counters), dict(self.timers))
+
+
+    def _end_move(self):
+        if self._current is None:
+            return
+        (move, counters, timers) = self._current
+        self.moves.append({'move': move,
+                           'counters': _delta(self.counters, counters),
+                           'timers': _delta(self.timers, timers)})
+        self._current = None
+
+
+    def export(self):
+        """Return the totals and the per-move data, as a dictionary of
+        plain values (for json, pickle...)"""
+        self._end_move()
+        return {'counters': dict(self.counters),
+                'timers': dict(self.timers),
+                'moves': list(self.moves)}
+
+
+def _delta(after, before):
+    result = dict()
+    for (k, v) in after.items():
+        d = v - before.get(k, 0)
+        if d:
+            result[k] = d
+    return result
@@ -1,6 +1,46 @@
-from game import Game, Helper
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Automatic players, and self-play evaluation of the heuristics
+
+Usage:
+    player.py [--heuristic=<h>] [--size=<s>] [--mode=<m>] [--games=<n>] [--seed=<n>] [--jobs=<n>]
+    player.py (-h | --help)
+
+Options:
+    -h, --help          Display help
+    --heuristic=<h>     Heuristic to evaluate [default: heuristic_2]
+    --size=<s>          Board size: small, medium or large [default: small]
+    --mode=<m>          The playing mode to use [default: normal]
+    --games=<n>         Number of games to play [default: 1000]
+    --seed=<n>          Seed used to derive the seed of each game [default: 1]
+    --jobs=<n>          Number of worker processes (default: all cores)
+"""
+
+from game import Game, Helper, BoardSize, Mode
+from transposition import TranspositionTable
+from replay import board_size
 import random
+import sys
+import threading
+import traceback
 import os.path as path
+from multiprocessing import Pool, cpu_count
+from time import perf_counter, time
+
+def _move_arrays(hp, act):
+    """Return the moves of act as arrays (src, dst, types) and the eval
+    cache array (see Actions.arrays and Helper.eval_array), or None if
+    numpy is not available (or there is no move). Scores of all the moves
+    are then computed at once, and the first best one is the one the
+    loops over act.moves() would select."""
+    values = hp.eval_array()
+    if values is None or not hasattr(act, 'arrays'):
+        return None
+    (src, dst, types) = act.arrays()
+    if len(src) == 0:
+        return None
+    return (src, dst, types, values)
+
 
 def heuristic_0(hp, act):
     """Heuristic player: selected move is the one with the biggest score between
@@ -8,15 +48,20 @@ def heuristic_0(hp, act):
     
     act : collection of all posible actions
     """
+    arrays = _move_arrays(hp, act)
+    if arrays is not None:
+        (src, dst, types, values) = arrays
+        k = values[dst, types].argmax()
+        cells = hp.board.cells()
+        return (cells[src[k]], cells[dst[k]])
     #search best move (highest difference of eval)
     best = None
-    for dst in act.keys():
-        for src in act[dst]:
-            eval_dst = hp.eval_move(src.piece, dst.row, dst.col)
-            if best is None or best < eval_dst:
-                best = eval_dst
-                best_dst = dst
-                best_src = src
+    for (src, dst) in act.moves():
+        eval_dst = hp.eval_move(src.piece, dst.row, dst.col)
+        if best is None or best < eval_dst:
+            best = eval_dst
+            best_dst = dst
+            best_src = src
     return (best_src, best_dst)
 
 
@@ -25,20 +70,34 @@ def heuristic_1(hp, act):
      * first destination cell is selected (best score),
      * then the source with the lowest score is selected
     """
+    arrays = _move_arrays(hp, act)
+    if arrays is not None:
+        (src, dst, types, values) = arrays
+        scores = values[dst, types]
+        best = (scores == scores.max()).nonzero()[0]
+        #first destination, then lowest type (the order of the loop)
+        best_dst = dst[best[0]]
+        best_type = types[best][dst[best] == best_dst].min()
+        sources = ((dst == best_dst) & (types == best_type)).nonzero()[0]
+        k = sources[values[src[sources], best_type].argmin()]
+        cells = hp.board.cells()
+        return (cells[src[k]], cells[best_dst])
     #search best destination (highest eval)
     best = None
-    for dst in act.keys():
+    for (cells, border) in act.regions:
         #extract possible types
-        types = set([c.piece for c in act[dst]])
-        for t in types:
-            eval_dst = hp.eval_move(t, dst.row, dst.col)
-            if best is None or best < eval_dst:
-                best = eval_dst
-                best_type = t
-                best_dst = dst
+        types = set([c.piece for c in border])
+        for dst in cells:
+            for t in types:
+                eval_dst = hp.eval_move(t, dst.row, dst.col)
+                if best is None or best < eval_dst:
+                    best = eval_dst
+                    best_type = t
+                    best_dst = dst
+                    best_border = border
     #search best source for this destination (lowest eval)
     best = None
-    for src in act[best_dst]:
+    for src in best_border:
         if src.piece == best_type:
             eval_src = hp.eval_move(src.piece, src.row, src.col) 
             if best is None or best > eval_src:
@@ -53,16 +112,15 @@ def heuristic_2(hp, act):
     
     act : collection of all posible actions
     """
-    #search best move (highest difference of eval)
-    best = None
-    for dst in act.keys():
-        for src in act[dst]:
-            eval_dst = hp.eval_move(src.piece, dst.row, dst.col)
-            eval_src = hp.eval_move(src.piece, src.row, src.col) 
-            if best is None or best < (eval_dst - eval_src):
-                best = eval_dst - eval_src
-                best_dst = dst
-                best_src = src
+    arrays = _move_arrays(hp, act)
+    if arrays is not None:
+        (src, dst, types, values) = arrays
+        k = (values[dst, types] - values[src, types]).argmax()
+        cells = hp.board.cells()
+        return (cells[src[k]], cells[dst[k]])
+    #search best move (highest difference of eval), stopping when no other
+    #move can be better
+    (value, best_src, best_dst) = hp.top_k(1, act)[0]
     return (best_src, best_dst)
 
 
@@ -70,19 +128,496 @@ def best_destination(hp, act):
     """Search the best destination.
     Return a tupple (row, col, type)"""
     best = None
-    for dst in act.keys():
-        for src in act[dst]:
-            eval_dst = hp.eval_move(src.piece, dst.row, dst.col)
-            if best is None or best < eval_dst:
-                best = eval_dst
-                best_dst = dst
-                t = src.piece.id
+    for (src, dst) in act.moves():
+        eval_dst = hp.eval_move(src.piece, dst.row, dst.col)
+        if best is None or best < eval_dst:
+            best = eval_dst
+            best_dst = dst
+            t = src.piece.id
                 
     return (best_dst.row, best_dst.col, t)
     
 
+def ranked_moves(hp, act, n = None):
+    """Return the moves (value, src, dst), by decreasing value of
+    heuristic_2 (difference of eval between destination and source). Moves
+    of same value keep the order of act, so that the first one is the
+    choice of heuristic_2. If n is given, only the n best are returned.
+    
+    >>> g = Game(seed = 4)
+    >>> hp = Helper(g)
+    >>> act = hp.actions()
+    >>> moves = ranked_moves(hp, act, 3)
+    >>> len(moves)
+    3
+    >>> moves[0][1:] == heuristic_2(hp, act)
+    True
+    >>> moves[0][0] >= moves[1][0] >= moves[2][0]
+    True
+    """
+    arrays = _move_arrays(hp, act)
+    if arrays is not None:
+        (src, dst, types, values) = arrays
+        scores = values[dst, types] - values[src, types]
+        #stable sort: moves of same value keep their order
+        order = (-scores).argsort(kind = 'stable')[:n]
+        cells = hp.board.cells()
+        return [(float(scores[k]), cells[src[k]], cells[dst[k]]) for k in order]
+    if n is not None:
+        return hp.top_k(n, act)
+    moves = [(hp.eval_move(src.piece, dst.row, dst.col)
+              - hp.eval_move(src.piece, src.row, src.col),
+              src, dst)
+             for (src, dst) in act.moves()]
+    moves.sort(key = lambda m: -m[0])
+    return moves[:n]
+
+
+class _Timeout(Exception):
+    pass
+
+
+class Expectimax:
+    """Lookahead player: expectimax search over the next moves, where the
+    random drops (see Game.fill_board) are chance nodes.
+    
+    depth: maximum number of moves searched ahead,
+    width: number of moves searched at each node, the best ones according
+      to heuristic_2 (the other moves are pruned),
+    samples: number of drops sampled after each move (a move that does not
+      use the random generator, e.g. a scoring move in normal mode, is
+      only searched once),
+    budget: if not None, time limit in seconds for each move. The search is
+      then iteratively deepened, and the best move of the last completed
+      depth is played (at worst, the choice of heuristic_2),
+    table: transposition table (see transposition) where the values of the
+      searched positions are kept between moves (by default, one of
+      TABLE_SIZE entries; clear it between games).
+    
+    The leaves are valued by their best heuristic_2 move, and a game over
+    by -GAME_OVER_PENALTY.
+    
+    An Expectimax object is used as a heuristic (see heuristic_player):
+    
+    >>> player = Expectimax(depth = 1, width = 3, samples = 2)
+    >>> g = Game(seed = 4)
+    >>> hp = Helper(g)
+    >>> (src, dst) = player(hp, hp.actions())
+    >>> player.completed_depth
+    1
+    >>> (src.row, src.col) in [(s.row, s.col) for (v, s, d) in ranked_moves(hp, hp.actions(), 3)]
+    True
+    >>> g.trace is not None and len(g.trace)
+    1
+    
+    With no time to search, it plays as heuristic_2:
+    
+    >>> player = Expectimax(budget = 0)
+    >>> player(hp, hp.actions()) == heuristic_2(hp, hp.actions())
+    True
+    >>> player.completed_depth
+    0
+    """
+    
+    GAME_OVER_PENALTY = 1000
+    LEAF_WEIGHT = 0.1
+    TABLE_SIZE = 10000
+    
+    def __init__(self, depth = 2, width = 4, samples = 3, budget = None, table = None):
+        self.depth = depth
+        self.width = width
+        self.samples = samples
+        self.budget = budget
+        if table is None:
+            table = TranspositionTable(Expectimax.TABLE_SIZE)
+        self.table = table
+        self.deadline = None
+        self.completed_depth = 0
+
+
+    def __call__(self, hp, act):
+        moves = ranked_moves(hp, act, self.width)
+        best = moves[0]
+        self.completed_depth = 0
+        if len(moves) == 1:
+            return best[1:]
+        if self.budget is None:
+            self.deadline = None
+        else:
+            self.deadline = perf_counter() + self.budget
+        #search on a copy of the game, so that the game (and its trace)
+        #is left unchanged, even if the search is interrupted
+        game = hp.game.clone()
+        #no table for the helper: eval caches are too large to be kept
+        helper = Helper(game, hp.engine)
+        for depth in range(1, self.depth + 1):
+            try:
+                values = [self._expect(game, helper, (s.row, s.col, d.row, d.col), depth)
+                          for (v, s, d) in moves]
+            except _Timeout:
+                break
+            #the first move of best value, i.e. the best one for heuristic_2
+            best = moves[values.index(max(values))]
+            self.completed_depth = depth
+        return best[1:]
+
+
+    def _expect(self, game, helper, move, depth):
+        """Return the expected score gain of move (chance node)"""
+        total = 0.0
+        for i in range(self.samples):
+            state = game.rng.getstate()
+            game.rng.seed(i)
+            seeded = game.rng.getstate()
+            score = game.score
+            game.apply(move)
+            value = game.score - score + self._value(game, helper, depth - 1)
+            certain = game.rng.getstate() == seeded
+            game.undo()
+            game.rng.setstate(state)
+            if certain:
+                return value
+            total += value
+        return total / self.samples
+
+
+    def _value(self, game, helper, depth):
+        """Return the value of the position of game (max node)"""
+        if self.deadline is not None and perf_counter() > self.deadline:
+            raise _Timeout()
+        if game.check_game_over():
+            return -Expectimax.GAME_OVER_PENALTY
+        #values of different depths are not comparable: depth is in the key
+        key = ('value', game.position_hash(), game.drop_delay, depth)
+        value = self.table.get(key)
+        if value is not None:
+            return value
+        helper.build_eval_cache()
+        moves = ranked_moves(helper, helper.actions(), self.width)
+        if len(moves) == 0:
+            value = 0
+        elif depth == 0:
+            value = Expectimax.LEAF_WEIGHT * moves[0][0]
+        else:
+            value = max(self._expect(game, helper, (s.row, s.col, d.row, d.col), depth)
+                        for (v, s, d) in moves)
+        self.table.store(key, value)
+        return value
+
+
+def rollout_position(game):
+    """Return the position of game in a compact form, to be sent to a
+    rollout worker: (size, mode, legacy_sampling, board buffer, next
+    pieces, drop delay)
+    
+    >>> g = Game(seed = 4)
+    >>> p = rollout_position(g)
+    >>> (p[0], p[1], len(p[3]))
+    (<BoardSize.SMALL: 1>, 'normal', 49)
+    """
+    return (board_size(game.n_rows, game.n_cols),
+            game.mode,
+            game.legacy_sampling,
+            bytes(game.board.pieces),
+            bytes(game.next_pieces_queue),
+            game.drop_delay)
+
+
+#game (and helper) of a rollout worker, for each kind of game
+_rollout_games = dict()
+
+def _rollout_game(position):
+    """Return the game and helper of this worker, at position (score 0)"""
+    (size, mode, legacy_sampling, pieces, queue, drop_delay) = position
+    key = (size, mode, legacy_sampling)
+    if key not in _rollout_games:
+        g = Game(size, mode, 1, legacy_sampling)
+        g.trace = None
+        _rollout_games[key] = (g, Helper(g))
+    (g, hp) = _rollout_games[key]
+    g.restore((pieces, g.rng.getstate(), 0, drop_delay, list(queue), None, 0))
+    return (g, hp)
+
+
+def _random_move(g, rng):
+    """Return a random possible move, or None"""
+    b = g.board
+    sources = b.occupied_cells()
+    rng.shuffle(sources)
+    for src in sources:
+        dist = b.distance_map(src.row, src.col)
+        targets = [i for (i, d) in enumerate(dist) if d > 0]
+        if targets:
+            (row, col) = divmod(rng.choice(targets), b.n_cols)
+            return (src.row, src.col, row, col)
+    return None
+
+
+def _rollout(g, hp, move, rng, policy, horizon):
+    """Make move, then at most horizon moves of the policy. Return the score"""
+    g.make_move(*move)
+    if policy == MonteCarlo.HEURISTIC:
+        hp.build_eval_cache()
+    for k in range(horizon):
+        if g.check_game_over():
+            break
+        if policy == MonteCarlo.HEURISTIC:
+            (src, dst) = heuristic_2(hp, hp.actions())
+            g.make_move(src.row, src.col, dst.row, dst.col)
+            hp.update_eval_cache(g.last_changes)
+        else:
+            m = _random_move(g, rng)
+            if m is None:
+                break
+            g.make_move(*m)
+    return g.score
+
+
+def _rollouts(args):
+    """Run rollouts of each move in a worker, either n_rollouts of them or
+    as many as possible until deadline (at least one). Return the (total
+    score, number of rollouts) of each move"""
+    (position, moves, n_rollouts, deadline, seed, policy, horizon) = args
+    rng = random.Random(seed)
+    (g, hp) = _rollout_game(position)
+    start = g.snapshot()
+    results = [[0, 0] for m in moves]
+    k = 0
+    while k == 0 or ((n_rollouts is None or k < n_rollouts)
+                     and (deadline is None or time() < deadline)):
+        for (i, move) in enumerate(moves):
+            g.restore(start)
+            g.rng.seed(rng.getrandbits(64))
+            results[i][0] += _rollout(g, hp, move, rng, policy, horizon)
+            results[i][1] += 1
+        k += 1
+    return results
+
+
+class MonteCarlo:
+    """Monte Carlo player: from each candidate move, rollouts are played
+    (random moves, or heuristic_2 moves, with random drops) for horizon
+    moves, and the move with the best mean score is chosen.
+    
+    n_rollouts: number of rollouts of each move, or None to play as many
+      as possible in budget seconds,
+    width: number of candidate moves, the best ones according to
+      heuristic_2 (None for all the moves),
+    processes: number of worker processes (default: all cores; 1 runs
+      the rollouts in this process). The workers share nothing: each gets
+      the position (see rollout_position) and its own seed.
+    
+    After each move, rollouts and rollouts_per_second report the amount
+    of simulation done.
+    
+    >>> g = Game(seed = 4)
+    >>> hp = Helper(g)
+    >>> with MonteCarlo(n_rollouts = 4, width = 3, horizon = 3, processes = 2, seed = 1) as player:
+    ...     (src, dst) = player(hp, hp.actions())
+    >>> (src, dst) in [m[1:] for m in ranked_moves(hp, hp.actions(), 3)]
+    True
+    >>> (player.rollouts, player.rollouts_per_second > 0)
+    (12, True)
+    
+    With a number of rollouts, the choice only depends on the seed:
+    
+    >>> players = [MonteCarlo(n_rollouts = 2, width = 2, policy = MonteCarlo.RANDOM,
+    ...                       processes = 1, seed = 1) for i in range(2)]
+    >>> players[0](hp, hp.actions()) == players[1](hp, hp.actions())
+    True
+    >>> players[0].rollouts
+    4
+    >>> len(g.trace)
+    1
+    """
+    
+    RANDOM = "random"
+    HEURISTIC = "heuristic"
+    
+    def __init__(self, n_rollouts = 16, budget = None, width = 8, horizon = 10,
+                 policy = HEURISTIC, processes = None, seed = None):
+        if n_rollouts is None and budget is None:
+            raise ValueError("either a number of rollouts or a budget is needed")
+        if policy not in (MonteCarlo.RANDOM, MonteCarlo.HEURISTIC):
+            raise ValueError("unknown rollout policy %s" % policy)
+        self.n_rollouts = n_rollouts
+        self.budget = budget
+        self.width = width
+        self.horizon = horizon
+        self.policy = policy
+        if processes is None:
+            processes = cpu_count()
+        self.processes = processes
+        self.rng = random.Random(seed)
+        self._pool = None
+        self.rollouts = 0
+        self.rollouts_per_second = 0.0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+    def __call__(self, hp, act):
+        moves = ranked_moves(hp, act, self.width)
+        if len(moves) == 1:
+            return moves[0][1:]
+        position = rollout_position(hp.game)
+        deadline = None if self.budget is None else time() + self.budget
+        tasks = []
+        for w in range(self.processes):
+            if self.n_rollouts is None:
+                n = None
+            else:
+                #rollouts of each move are shared between the workers
+                n = self.n_rollouts // self.processes + (w < self.n_rollouts % self.processes)
+                if n == 0:
+                    continue
+            tasks.append((position,
+                          [(s.row, s.col, d.row, d.col) for (v, s, d) in moves],
+                          n, deadline, self.rng.getrandbits(64),
+                          self.policy, self.horizon))
+        start = perf_counter()
+        if self.processes == 1:
+            results = map(_rollouts, tasks)
+        else:
+            if self._pool is None:
+                self._pool = Pool(self.processes)
+            results = self._pool.imap_unordered(_rollouts, tasks)
+        totals = [[0, 0] for m in moves]
+        for result in results:
+            for (t, (score, n)) in zip(totals, result):
+                t[0] += score
+                t[1] += n
+        elapsed = perf_counter() - start
+        self.rollouts = sum(n for (score, n) in totals)
+        self.rollouts_per_second = self.rollouts / elapsed if elapsed > 0 else 0.0
+        means = [score / n for (score, n) in totals]
+        #the first move of best mean, i.e. the best one for heuristic_2
+        return moves[means.index(max(means))][1:]
+
+
+class MoveWorker:
+    """Compute the moves chosen by players in a background thread, once
+    per position.
+    
+    request(game, player) returns the move (src_row, src_col, dst_row,
+    dst_col, piece) chosen by player (a heuristic, see heuristic_player)
+    in the current position of game if it is already known, and None
+    otherwise: the move is then computed in background, on a copy of the
+    game. Only the requests for the last requested position are kept. A
+    move that is being computed is not requested again, and a player that
+    fails (its error is printed) is not called again for that position.
+    
+    >>> w = MoveWorker()
+    >>> g = Game(seed = 4)
+    >>> w.request(g, heuristic_2) is None
+    True
+    >>> w.wait()
+    >>> move = w.request(g, heuristic_2)
+    >>> hp = Helper(g)
+    >>> (src, dst) = heuristic_2(hp, hp.actions())
+    >>> move == (src.row, src.col, dst.row, dst.col, src.piece)
+    True
+    >>> g.make_move(*move[:4])
+    >>> w.request(g, heuristic_2) is None
+    True
+    
+    A failing player does not stop the worker:
+    
+    >>> def broken(hp, act):
+    ...     raise ValueError("no move")
+    >>> import contextlib, io
+    >>> with contextlib.redirect_stderr(io.StringIO()) as err:
+    ...     w.request(g, broken)
+    ...     w.wait()
+    >>> 'ValueError: no move' in err.getvalue()
+    True
+    >>> w.request(g, broken) is None
+    True
+    >>> w.request(g, heuristic_2) is not None
+    True
+    """
+    
+    def __init__(self, capacity = 1000):
+        #known moves, by (position, player)
+        self.moves = TranspositionTable(capacity)
+        #copy of the game of each requested (position, player)
+        self._pending = dict()
+        #(position, player) being computed, and the ones that failed for
+        #the last position
+        self._running = None
+        self._failed = set()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+
+    def request(self, game, player):
+        position = (game.position_hash(), game.drop_delay)
+        with self._condition:
+            move = self.moves.get((position, player))
+            if move is not None:
+                return move
+            for key in [key for key in self._pending if key[0] != position]:
+                del self._pending[key]
+            self._failed = set(key for key in self._failed if key[0] == position)
+            key = (position, player)
+            if key not in self._pending \
+               and key != self._running \
+               and key not in self._failed \
+               and not game.check_game_over():
+                self._pending[key] = game.clone()
+                self._condition.notify_all()
+        return None
+
+
+    def wait(self):
+        """Wait until all the requested moves are known"""
+        with self._condition:
+            while self._pending or self._running is not None:
+                self._condition.wait()
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                (key, game) = next(iter(self._pending.items()))
+                del self._pending[key]
+                self._running = key
+            move = None
+            try:
+                hp = Helper(game)
+                (src, dst) = key[1](hp, hp.actions())
+                move = (src.row, src.col, dst.row, dst.col, src.piece)
+            except Exception:
+                #keep the worker running for the next positions
+                traceback.print_exc()
+            with self._condition:
+                self._running = None
+                if move is None:
+                    self._failed.add(key)
+                else:
+                    self.moves.store(key, move)
+                self._condition.notify_all()
+
+
 def heuristic_player(g, h, log=False):
     hp = Helper(g)
+    hp.build_eval_cache()
     mem = []
     while not g.check_game_over():
         act = hp.actions()
@@ -91,12 +626,12 @@ def heuristic_player(g, h, log=False):
             print("next: %s" % [p.id for p in g.next_pieces_queue])
             g.board.print()
         #search best action
-        hp.build_eval_cache()
         (src, dst) = h(hp, act)
         #apply action
         if log:
             print("moving %d from %s to %s" % (src.piece.id, (src.row, src.col), (dst.row, dst.col)))
         g.make_move(src.row, src.col, dst.row, dst.col)
+        hp.update_eval_cache(g.last_changes)
         if log:
             g.board.print()
             print("================================================================")
@@ -112,41 +647,151 @@ def step(g):
     (src, dst) = heuristic_2(hp, act)
     #apply action
     g.make_move(src.row, src.col, dst.row, dst.col)
+
+
+HEURISTICS = {'heuristic_0': heuristic_0,
+              'heuristic_1': heuristic_1,
+              'heuristic_2': heuristic_2,
+              'expectimax': Expectimax(depth = 1)}
+
+
+class ScoreStats:
+    """Streaming statistics on game scores: count, mean, variance,
+    min, max and an histogram with fixed width bins, in constant memory.
     
+    >>> s = ScoreStats(bin_width = 10)
+    >>> for x in [12, 18, 25, 45]:
+    ...     s.add(x)
+    >>> (s.n, s.mean, s.variance, s.min, s.max)
+    (4, 25.0, 206.0, 12, 45)
+    >>> sorted(s.histogram.items())
+    [(10, 2), (20, 1), (40, 1)]
+    """
+
+    def __init__(self, bin_width = 10):
+        self.bin_width = bin_width
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = dict()
+
+
+    def add(self, score):
+        #Welford's online algorithm
+        self.n += 1
+        delta = score - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (score - self.mean)
+        if self.min is None or score < self.min:
+            self.min = score
+        if self.max is None or score > self.max:
+            self.max = score
+        b = (score // self.bin_width) * self.bin_width
+        self.histogram[b] = self.histogram.get(b, 0) + 1
+
+
+    @property
+    def variance(self):
+        if self.n < 2:
+            return 0.0
+        return self._m2 / (self.n - 1)
+
+
+def game_seeds(seed, n_games):
+    """Yield the (non zero) seed of each game, derived from seed
     
+    >>> list(game_seeds(1, 3)) == list(game_seeds(1, 3))
+    True
+    >>> 0 in game_seeds(1, 1000)
+    False
+    """
+    rng = random.Random(seed)
+    for i in range(n_games):
+        yield rng.randrange(1, sys.maxsize)
+
+
+def _play_game(args):
+    """Play a game in a worker, return (seed, score, number of moves)
+    
+    >>> g = Game(BoardSize.SMALL, Mode.DISTANCE, 1)
+    >>> score = heuristic_player(g, heuristic_2)
+    >>> _play_game(('heuristic_2', BoardSize.SMALL, Mode.DISTANCE, 1)) == (1, score, len(g.moves))
+    True
+    """
+    (heuristic, size, mode, seed) = args
+    g = Game(size, mode, seed)
+    #no trace is kept: only the moves are counted
+    g.trace = None
+    h = HEURISTICS[heuristic]
+    if isinstance(h, Expectimax):
+        #the player is kept by the worker: do not grow its table over games
+        h.table.clear()
+    score = heuristic_player(g, h)
+    return (seed, score, len(g.moves))
+
+
+def self_play(heuristic, n_games, size = BoardSize.SMALL, mode = Mode.NORMAL,
+              seed = 1, processes = None):
+    """Play n_games with the named heuristic over a pool of processes.
+    Yield (seed, score, number of moves) for each game, as soon as it is
+    finished (so not in seed order).
+    
+    >>> r = list(self_play('heuristic_0', 4, processes = 2))
+    >>> len(r)
+    4
+    >>> sorted(r) == sorted(self_play('heuristic_0', 4, processes = 1))
+    True
+    """
+    if heuristic not in HEURISTICS:
+        raise ValueError("unknown heuristic %s" % heuristic)
+    tasks = ((heuristic, size, mode, s) for s in game_seeds(seed, n_games))
+    with Pool(processes) as pool:
+        for result in pool.imap_unordered(_play_game, tasks):
+            yield result
+
+
 
 if __name__=='__main__':
     import matplotlib
-    import numpy as np
     import matplotlib.pyplot as plt
-    import scipy.io
+    from docopt import docopt
     
-    scores = []
-    for i in range(1000):
-        g = Game()
-        scores.append(heuristic_player(g, heuristic_2, False))
-        print('game %s' % i)
+    args = docopt(__doc__)
+    if args['--jobs']:
+        jobs = int(args['--jobs'])
+    else:
+        jobs = None
+    size = BoardSize[args['--size'].upper()]
+    stats = ScoreStats()
+    for (i, (seed, score, n_moves)) in enumerate(self_play(args['--heuristic'],
+                                                           int(args['--games']),
+                                                           size,
+                                                           args['--mode'],
+                                                           int(args['--seed']),
+                                                           jobs)):
+        stats.add(score)
+        print('game %s (seed %d): %d in %d moves' % (i, seed, score, n_moves))
         
     print("moyenne:")
-    print(sum(scores)/len(scores))    
-    
-    #if path.isfile('heuristic.mat'):
-    #    mat = scipy.io.loadmat('heuristic.mat')
-    #    scores = mat['score'].tolist()[0] + scores
-    #scipy.io.savemat('heuristic.mat', {'score':scores})
-    
-    
+    print(stats.mean)
+    print("variance:")
+    print(stats.variance)
     
-    num_bins = 20
     fig, ax = plt.subplots()
 
     # the histogram of the data
-    n, bins, patches = ax.hist(scores, num_bins, density=1)
+    bins = sorted(stats.histogram.keys())
+    ax.bar(bins,
+           [stats.histogram[b] / (stats.n * stats.bin_width) for b in bins],
+           width = stats.bin_width,
+           align = 'edge')
 
 
     ax.set_xlabel('Score')
     ax.set_ylabel('Probability density')
-    ax.set_title(r'Score for heuristic player (n = %d)' % len(scores))
+    ax.set_title(r'Score for %s (n = %d)' % (args['--heuristic'], stats.n))
 
     # Tweak spacing to prevent clipping of ylabel
     fig.tight_layout()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Replay of recorded games, with random access to any step.
+
+A game is simulated again from its seed and its list of moves. Snapshots
+of the game are kept every few moves, so that going to a step only
+replays the moves since the previous snapshot.
+"""
+
+from game import Game, BoardSize, Mode
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+def board_size(n_rows, n_cols):
+    """Return the BoardSize of a n_rows x n_cols board
+
+    >>> board_size(9, 9)
+    <BoardSize.MEDIUM: 2>
+    """
+    for (size, d) in Game.DIFFICULTY.items():
+        if d[:2] == (n_rows, n_cols):
+            return size
+    raise ValueError("no board size is %d x %d" % (n_rows, n_cols))
+
+
+class Replay:
+    """Replay of a game. Step k is the state of the game after its k-th
+    move (step 0 is the initial state).
+
+    >>> from player import heuristic_player, heuristic_2
+    >>> g = Game(mode = Mode.DISTANCE, seed = 5)
+    >>> score = heuristic_player(g, heuristic_2)
+    >>> r = Replay(5, g.moves, mode = Mode.DISTANCE, interval = 4)
+    >>> len(r) == len(g.moves) + 1
+    True
+    >>> r.seek(len(r) - 1).board.pieces == g.board.pieces
+    True
+    >>> r.seek(len(r) - 1).score == g.score
+    True
+    >>> r.seek(3).moves == g.moves[:3]
+    True
+    >>> scores = r.features(lambda game: game.score)
+    >>> scores == sorted(scores) and scores[-1] == g.score
+    True
+    >>> [game.score for game in reversed(r)] == scores[::-1]
+    True
+    >>> r.seek(0).board.pieces == Game(mode = Mode.DISTANCE, seed = 5).board.pieces
+    True
+    """
+
+    def __init__(self, seed, moves, size = BoardSize.SMALL, mode = Mode.NORMAL,
+                 interval = 50):
+        self.moves = list(moves)
+        self.interval = interval
+        self.game = Game(size, mode, seed)
+        self.game.trace = None
+        #snapshot of steps 0, interval, 2*interval...
+        self.checkpoints = []
+        for (k, move) in enumerate(self.moves):
+            if k % interval == 0:
+                self.checkpoints.append(self.game.snapshot())
+            self.game.make_move(*move)
+        if len(self.moves) % interval == 0:
+            self.checkpoints.append(self.game.snapshot())
+        self.position = len(self.moves)
+
+
+    @staticmethod
+    def from_trace(seed, trace, size = BoardSize.SMALL, mode = Mode.NORMAL,
+                   interval = 50):
+        """Create the replay of a recorded trace (see gametrace). In distance
+        mode, a move can be recorded in several steps of the trace."""
+        if hasattr(trace, 'moves'):
+            recorded = list(trace.moves())[1:]
+        else:
+            recorded = [step[2] for step in trace[1:]]
+        g = Game(size, mode, seed)
+        moves = []
+        k = 0
+        while k < len(recorded):
+            n_steps = len(g.trace)
+            g.make_move(*recorded[k])
+            moves.append(recorded[k])
+            k += max(len(g.trace) - n_steps, 1)
+        return Replay(seed, moves, size, mode, interval)
+
+
+    def __len__(self):
+        return len(self.moves) + 1
+
+
+    def seek(self, k):
+        """Return the game at step k. The game object is shared by all the
+        steps: it changes at the next call."""
+        if k < 0:
+            k += len(self)
+        if k < 0 or k >= len(self):
+            raise IndexError("replay step out of range")
+        checkpoint = k // self.interval
+        if k < self.position or self.position < checkpoint * self.interval:
+            self.game.restore(self.checkpoints[checkpoint])
+            self.position = checkpoint * self.interval
+        while self.position < k:
+            self.game.make_move(*self.moves[self.position])
+            self.position += 1
+        return self.game
+
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.seek(k)
+
+
+    def __reversed__(self):
+        #each block between two checkpoints is replayed once, forward, and
+        #its steps are then restored backward
+        last = len(self) - 1
+        for checkpoint in range(last // self.interval, -1, -1):
+            start = checkpoint * self.interval
+            stop = min(start + self.interval, last + 1)
+            states = []
+            for k in range(start, stop):
+                states.append(self.seek(k).snapshot())
+            for k in range(stop - 1, start - 1, -1):
+                self.game.restore(states[k - start])
+                self.position = k
+                yield self.game
+
+
+    def features(self, function, start = 0, stop = None):
+        """Return [function(game) for each step from start to stop]"""
+        if stop is None:
+            stop = len(self)
+        return [function(self.seek(k)) for k in range(start, stop)]
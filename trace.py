@@ -14,9 +14,7 @@
         -b MAX_SCORE select games with score below MAX_SCORE
 """
 
-import shelve
 from datetime import datetime
-import operator
 
 import matplotlib
 import numpy as np
@@ -24,51 +22,62 @@ import matplotlib.pyplot as plt
 import scipy.io
 from docopt import docopt
 
+from tracedb import TraceDB
+
 args = docopt(__doc__)
 print(args)
 
-data = []
 
-def filter(d):
-    if args['-s'] and d['seed'] != int(args['-s']):
-        return False
-    if args['-m'] and d['mode'] != args['-m']:
-        return False
-    if args['-a'] and d['score'] < int(args['-a']):
-        return False
-    if args['-b'] and d['score'] > int(args['-b']):
-        return False
-    return True
+def selection():
+    """Game selection (see TraceDB.query) given by the command line"""
+    return {'seed': int(args['-s']) if args['-s'] else None,
+            'mode': args['-m'],
+            'min_score': int(args['-a']) if args['-a'] else None,
+            'max_score': int(args['-b']) if args['-b'] else None}
 
 
+def free_cells(trace):
+    """Yield the number of free cells at each step of trace"""
+    for tr in trace:
+        yield tr[0].count(None)
 
-with shelve.open('trace.db') as db:
-    for k in db.keys():
-        if filter(db[k]):
-            d = db[k]
-            data.append(d)
-            print("%s\t%s\t%s\t%d moves\t%s " % (k,  d['score'], d['seed'], len(d['trace']), d['mode']))
-    
-    
 
-scores = [d['score'] for d in data]
-traces = [d['trace'] for d in data]
-nb_free = [[tr[0].count(None) for tr in trace] for trace in traces]
+db = TraceDB('trace.db')
+for d in db.query(**selection()):
+    print("%s\t%s\t%s\t%d moves\t%s " % (d['key'],  d['score'], d['seed'], d['n_moves'], d['mode']))
+
 
 if args['histo']:
     
     
+    #two passes on the index: score range, then bin counts
+    (low, high, n) = (None, None, 0)
+    for d in db.query(**selection()):
+        if low is None or d['score'] < low:
+            low = d['score']
+        if high is None or d['score'] > high:
+            high = d['score']
+        n += 1
+    if n == 0:
+        exit()
     
     num_bins = 25
+    width = max(high - low, 1) / num_bins
+    counts = [0] * num_bins
+    for d in db.query(**selection()):
+        counts[min(int((d['score'] - low) / width), num_bins - 1)] += 1
     fig, ax = plt.subplots()
 
     # the histogram of the data
-    n, bins, patches = ax.hist(scores, num_bins, density=1)
+    ax.bar([low + i * width for i in range(num_bins)],
+           [c / (n * width) for c in counts],
+           width = width,
+           align = 'edge')
 
 
     ax.set_xlabel('Score')
     ax.set_ylabel('Probability density')
-    ax.set_title(r'Score in normal mode (n = %d)' % len(scores))
+    ax.set_title(r'Score in normal mode (n = %d)' % n)
 
     # Tweak spacing to prevent clipping of ylabel
     fig.tight_layout()
@@ -81,30 +90,33 @@ if args['plot_free']:
     
     
     fig, ax = plt.subplots()
-    for y in nb_free:
-        ax.plot(y)
+    n = 0
+    for (d, trace) in db.traces(**selection()):
+        ax.plot(list(free_cells(trace)))
+        n += 1
     ax.set_ylabel('Number of free cells')
     ax.set_xlabel('Moves')
-    ax.set_title(r'Number of free cells (%d games)' % len(traces))
+    ax.set_title(r'Number of free cells (%d games)' % n)
     plt.show()
     exit()
 
 if args['plot_score']:
 
     fig, ax = plt.subplots()
-    data = []
-    for nb in nb_free:
-        y = list(map(operator.sub,nb[1:], nb[:-1]))
-        d = [nb[i-1] for i in range(1,len(nb)) if y[i-1] > 0]
-        data.extend(d)
-    nb_bins = max(data) - min(data)
-    ax.hist(data, nb_bins, density=1)
+    #number of free cells before each score, counted over all games
+    counts = dict()
+    n = 0
+    for (d, trace) in db.traces(**selection()):
+        previous = None
+        for nb in free_cells(trace):
+            if previous is not None and nb - previous > 0:
+                counts[previous] = counts.get(previous, 0) + 1
+            previous = nb
+        n += 1
+    total = sum(counts.values())
+    ax.bar(list(counts.keys()), [c / total for c in counts.values()], width = 1)
     ax.set_ylabel('probabity to score')
     ax.set_xlabel('Number of free cells (before score')
-    ax.set_title(r'Probability to score (%d games)' % len(traces))
+    ax.set_title(r'Probability to score (%d games)' % n)
     plt.show()
     exit()
-    
-    
-
-    
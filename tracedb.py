@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Database of game traces.
+
+The traces are kept in a shelve (as saved by the game window), and their
+metadata (seed, mode, score, size, number of moves, timestamp) in a sqlite
+index beside it, so that games can be selected without loading any trace.
+"""
+
+import os
+import shelve
+import sqlite3
+from datetime import datetime
+
+import gametrace
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS games (
+    key TEXT PRIMARY KEY,
+    timestamp TEXT,
+    seed INTEGER,
+    mode TEXT,
+    score INTEGER,
+    n_rows INTEGER,
+    n_cols INTEGER,
+    n_moves INTEGER)"""
+
+COLUMNS = ('key', 'timestamp', 'seed', 'mode', 'score', 'n_rows', 'n_cols', 'n_moves')
+
+
+class TraceDB:
+    """Trace database, with a metadata index.
+
+    >>> import tempfile
+    >>> from game import Game
+    >>> d = tempfile.mkdtemp()
+    >>> with TraceDB(os.path.join(d, 'trace.db')) as db:
+    ...     for seed in (1, 2, 3):
+    ...         g = Game(seed = seed)
+    ...         db.add(g, datetime(2020, 1, seed))
+    ...     games = list(db.query(seed = 2))
+    ...     [m['seed'] for m in db.query(min_score = 0, max_score = 0)]
+    [1, 2, 3]
+    >>> (games[0]['key'], games[0]['n_moves'], games[0]['n_rows'])
+    ('2020-01-02 00:00:00', 0, 7)
+    >>> with TraceDB(os.path.join(d, 'trace.db')) as db:
+    ...     [(m['seed'], len(t)) for (m, t) in db.traces(mode = 'normal')]
+    [(1, 1), (2, 1), (3, 1)]
+    
+    In distance mode, a move can take several steps of the trace:
+    
+    >>> from game import Helper, Mode
+    >>> from player import heuristic_2
+    >>> g = Game(seed = 1, mode = Mode.DISTANCE)
+    >>> for i in range(3):
+    ...     hp = Helper(g)
+    ...     (src, dst) = heuristic_2(hp, hp.actions())
+    ...     g.make_move(src.row, src.col, dst.row, dst.col)
+    >>> with TraceDB(os.path.join(d, 'trace.db')) as db:
+    ...     db.add(g, datetime(2020, 2, 1))
+    ...     db.reindex()
+    ...     [(m['n_moves'], len(t) - 1) for (m, t) in db.traces(mode = 'distance')]
+    [(3, 5)]
+    """
+
+    def __init__(self, path = 'trace.db', index = None):
+        self.path = path
+        if index is None:
+            index = path + '.idx'
+        new_index = not os.path.exists(index)
+        self.shelf = shelve.open(path)
+        self.index = sqlite3.connect(index)
+        self.index.execute(SCHEMA)
+        self.index.execute("CREATE INDEX IF NOT EXISTS games_score ON games (score)")
+        if new_index and len(self.shelf) > 0:
+            self.reindex()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        self.index.commit()
+        self.index.close()
+        self.shelf.close()
+
+
+    def add(self, game, timestamp = None):
+        """Save the trace of a finished game"""
+        if timestamp is None:
+            timestamp = datetime.now()
+        key = str(timestamp)
+        d = {'trace': game.trace.to_bytes(),
+             'size': (game.n_rows, game.n_cols),
+             'mode': game.mode,
+             'score': game.score,
+             'seed': game.seed,
+             'n_moves': len(game.moves)}
+        self.shelf[key] = d
+        self._index(key, d)
+        self.index.commit()
+
+
+    def _index(self, key, d):
+        (n_rows, n_cols) = d.get('size', (None, None))
+        n_moves = d.get('n_moves')
+        if n_moves is None:
+            #saved without its number of moves: count the steps of the
+            #trace (more than the moves in distance mode)
+            n_moves = len(gametrace.load(d['trace'])) - 1
+        self.index.execute("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (key, key, d['seed'], d['mode'], d['score'],
+                            n_rows, n_cols, n_moves))
+
+
+    def reindex(self):
+        """Rebuild the index from the shelve (one trace in memory at a time)"""
+        self.index.execute("DELETE FROM games")
+        for key in self.shelf.keys():
+            self._index(key, self.shelf[key])
+        self.index.commit()
+
+
+    def query(self, seed = None, mode = None, min_score = None, max_score = None):
+        """Yield the metadata (dictionaries) of the selected games, from the
+        index only"""
+        (where, params) = ([], [])
+        for (test, value) in (("seed = ?", seed),
+                              ("mode = ?", mode),
+                              ("score >= ?", min_score),
+                              ("score <= ?", max_score)):
+            if value is not None:
+                where.append(test)
+                params.append(value)
+        sql = "SELECT %s FROM games" % ", ".join(COLUMNS)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp"
+        for row in self.index.execute(sql, params):
+            yield dict(zip(COLUMNS, row))
+
+
+    def traces(self, **selection):
+        """Yield (metadata, trace) of the selected games (see query), loading
+        the traces one at a time"""
+        for meta in self.query(**selection):
+            yield (meta, gametrace.load(self.shelf[meta['key']]['trace']))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Bounded transposition table, keyed by position hashes (see Board.hash)
+"""
+
+from collections import OrderedDict
+
+__author__="Rémi Pannequin"
+__copyright__ = "Copyright 2020"
+__credits__ = ["Rémi Pannequin"]
+__license__ = "GPL"
+__maintainer__ = "Rémi Pannequin"
+__email__ = "remi.pannequin@gmail.com"
+__status__ = "Development"
+
+
+class TranspositionTable:
+    """Table of at most capacity entries (key, value, depth).
+
+    With the LRU policy, the least recently used entry is evicted when the
+    table is full. With the DEPTH policy, each key has a single slot
+    (key modulo capacity), and a stored entry is only replaced by an entry
+    of at least the same depth.
+
+    >>> t = TranspositionTable(2)
+    >>> t.store(1, 'a')
+    >>> t.store(2, 'b')
+    >>> t.get(1)
+    'a'
+    >>> t.store(3, 'c')
+    >>> t.get(2) is None
+    True
+    >>> (t.hits, t.misses, t.evictions, len(t))
+    (1, 1, 1, 2)
+
+    >>> t = TranspositionTable(4, TranspositionTable.DEPTH)
+    >>> t.store(1, 'deep', depth = 3)
+    >>> t.store(5, 'shallow', depth = 1)
+    >>> (t.get(1), t.get(5))
+    ('deep', None)
+    >>> t.get(1, depth = 4) is None
+    True
+    """
+
+    LRU = "lru"
+    DEPTH = "depth"
+
+    def __init__(self, capacity = 100000, policy = LRU):
+        if policy not in (TranspositionTable.LRU, TranspositionTable.DEPTH):
+            raise ValueError("unknown replacement policy %s" % policy)
+        self.capacity = capacity
+        self.policy = policy
+        self.clear()
+
+
+    def clear(self):
+        if self.policy == TranspositionTable.LRU:
+            self.entries = OrderedDict()
+        else:
+            self.entries = [None] * self.capacity
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return self.size
+
+
+    def get(self, key, depth = 0):
+        """Return the value stored for key with at least this depth, or
+        None"""
+        if self.policy == TranspositionTable.LRU:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        else:
+            entry = self.entries[hash(key) % self.capacity]
+            if entry is not None and entry[0] != key:
+                entry = None
+        if entry is None or entry[2] < depth:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+
+    def store(self, key, value, depth = 0):
+        self.stores += 1
+        if self.policy == TranspositionTable.LRU:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            else:
+                if self.size >= self.capacity:
+                    self.entries.popitem(last = False)
+                    self.evictions += 1
+                else:
+                    self.size += 1
+            self.entries[key] = (key, value, depth)
+        else:
+            slot = hash(key) % self.capacity
+            entry = self.entries[slot]
+            if entry is None:
+                self.size += 1
+            elif entry[2] > depth:
+                #keep the deeper entry
+                return
+            elif entry[0] != key:
+                self.evictions += 1
+            self.entries[slot] = (key, value, depth)
+
+
+    def counters(self):
+        """Return the usage counters of the table"""
+        return {'policy': self.policy,
+                'capacity': self.capacity,
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions}